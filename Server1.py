@@ -1,21 +1,60 @@
 #!/usr/bin/env python3
 """
 WIDS SERVER - FIXED VERSION
-Dashboard shows devices, MACs added in dashboard update server.py
+Dashboard shows devices, MACs added in dashboard are saved to authorized_macs.json
 """
-from flask import Flask, request, jsonify, render_template_string
-from datetime import datetime, timedelta
-from collections import defaultdict
+from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from datetime import datetime
+from collections import deque, OrderedDict
+from itertools import islice
 import json
 import subprocess
 import threading
 import time
 import os
 import re
+import socket
+import sys
+import atexit
+import gzip
+import hashlib
+import queue
+import logging
+import logging.handlers
+
+try:
+    import orjson  # Optional: faster JSON encoding/decoding for the API
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Same argument rules as jsonify(), encoded straight to bytes
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if kwargs:
+            obj = kwargs
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or None
+        return self._app.response_class(orjson.dumps(obj, default=self.default),
+                                        mimetype=self.mimetype)
 
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 # ========== CONFIGURATION ==========
+# Seed for authorized_macs.json when it does not exist yet
 WHITELIST_MACS = [
     "AA:BB:CC:DD:EE:FF",  # Example: Your laptop MAC
     "11:22:33:44:55:66",  # Example: Your phone MAC
@@ -24,14 +63,110 @@ WHITELIST_MACS = [
 # File to persist authorized MACs
 AUTHORIZED_MACS_FILE = "authorized_macs.json"
 
+# Per-packet log lines are DEBUG; set to logging.DEBUG to see every packet
+LOG_LEVEL = logging.INFO
+
+# MAC addresses accepted from the API, after upper-casing
+MAC_RE = re.compile(r'([0-9A-F]{2}:){5}[0-9A-F]{2}')  # Use fullmatch: $ would also accept a trailing newline
+
+def canonical_mac(mac):
+    """Upper-cased, interned MAC so every copy of it is the same str object"""
+    return sys.intern(str(mac).upper())
+
+# ========== LOGGING ==========
+# Request threads only put records on a queue; one listener thread writes them
+log = logging.getLogger('wids')
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+log_queue = queue.SimpleQueue()
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+log_listener.start()
+atexit.register(log_listener.stop)
+
 # ========== DATA STORAGE ==========
-devices = {}          # MAC -> device info
-packets = []          # Recent packets
+class Device:
+    """State kept per detected MAC (slots: no per-instance dict)"""
+    __slots__ = ('mac', 'first_seen', 'last_seen', 'last_seen_ts', 'packet_count',
+                 'rssi', 'channel', 'authorized', 'sensor')
+    
+    def __init__(self, mac, now, now_iso, rssi, channel, authorized, sensor):
+        self.mac = mac
+        self.first_seen = now_iso
+        self.last_seen = now_iso
+        self.last_seen_ts = now  # Epoch copy of last_seen for age checks
+        self.packet_count = 1
+        self.rssi = rssi
+        self.channel = channel
+        self.authorized = authorized
+        self.sensor = sensor
+
+devices = {}          # MAC -> Device
+packets = deque(maxlen=100)  # Recent packets (oldest dropped automatically)
 blocked_macs = set()  # Manually blocked devices
 sensors = {}          # Sensor info
 authorized_macs = set()  # Authorized MACs (loaded from file)
-packet_rates = defaultdict(list)  # MAC -> list of timestamps
-threat_log = []       # Threat detection log
+threat_log = deque(maxlen=100)  # Threat detection log
+state_lock = threading.Lock()  # Guards the read-modify-write updates above across server threads
+
+# Devices seen in the last hour, least recently seen first, so /api/stats
+# only has to expire the front instead of scanning every device
+active_devices = OrderedDict()  # MAC -> None
+active_authorized = 0           # How many of active_devices are authorized
+
+# Revisions for ETags on /api/devices and /api/authorized; the process start
+# time keeps tags from an earlier run from matching after a restart
+STATE_EPOCH = f"{int(time.time()):x}"
+devices_rev = 0     # Bumped whenever a device row changes (hold state_lock)
+authorized_rev = 0  # Bumped whenever authorized_macs changes (hold state_lock)
+
+def mark_active(mac):
+    """Move MAC to the most recent end of active_devices (hold state_lock)"""
+    global active_authorized, devices_rev
+    devices_rev += 1
+    if mac in active_devices:
+        active_devices.move_to_end(mac)
+    else:
+        active_devices[mac] = None
+        if devices[mac].authorized:
+            active_authorized += 1
+
+def expire_active(now):
+    """Drop devices not seen for an hour from active_devices (hold state_lock)"""
+    global active_authorized
+    while active_devices:
+        mac = next(iter(active_devices))
+        if now - devices[mac].last_seen_ts < 3600:
+            break
+        del active_devices[mac]
+        if devices[mac].authorized:
+            active_authorized -= 1
+
+def set_device_authorized(mac, authorized):
+    """Update a known device's authorized flag and the active count (hold state_lock)"""
+    global active_authorized, devices_rev
+    info = devices.get(mac)
+    if info is None or info.authorized == authorized:
+        return
+    info.authorized = authorized
+    devices_rev += 1
+    if mac in active_devices:
+        active_authorized += 1 if authorized else -1
+
+# ========== LIVE UPDATES ==========
+MAX_EVENT_SUBSCRIBERS = 4  # Each open stream holds a server thread; extra dashboards poll
+PACKET_EVENT_INTERVAL = 5.0  # Packets arrive constantly; tell a dashboard at most this often (the old poll rate)
+event_subscribers = set()  # One queue of changed-data names per /api/events stream
+subscribers_lock = threading.Lock()
+
+def publish_event(kind):
+    """Tell every open dashboard stream that one kind of data changed"""
+    with subscribers_lock:
+        for q in event_subscribers:
+            try:
+                q.put_nowait(kind)
+            except queue.Full:
+                pass  # Stream is behind; it refreshes everything it has queued anyway
 
 # ========== LOAD AUTHORIZED MACS FROM FILE ==========
 def load_authorized_macs():
@@ -41,55 +176,64 @@ def load_authorized_macs():
         if os.path.exists(AUTHORIZED_MACS_FILE):
             with open(AUTHORIZED_MACS_FILE, 'r') as f:
                 data = json.load(f)
-                authorized_macs = set(data.get('authorized_macs', WHITELIST_MACS))
+                authorized_macs = {canonical_mac(m) for m in data.get('authorized_macs', WHITELIST_MACS)}
             print(f"✅ Loaded {len(authorized_macs)} authorized MACs from file")
         else:
-            authorized_macs = set(WHITELIST_MACS)
-            save_authorized_macs()
+            authorized_macs = {canonical_mac(m) for m in WHITELIST_MACS}
+            flush_authorized_macs()
     except Exception as e:
         print(f"❌ Error loading authorized MACs: {e}")
-        authorized_macs = set(WHITELIST_MACS)
+        authorized_macs = {canonical_mac(m) for m in WHITELIST_MACS}
 
-def save_authorized_macs():
-    """Save authorized MACs to file"""
+auth_dirty = threading.Event()      # Set when authorized_macs has unsaved changes
+auth_file_lock = threading.Lock()   # Serializes writes of AUTHORIZED_MACS_FILE
+auth_flusher = None                 # Background writer, started by the first save
+auth_flusher_lock = threading.Lock()
+
+def flush_authorized_macs():
+    """Write authorized MACs to file (temp file + rename, so it is never half-written)"""
     try:
-        with open(AUTHORIZED_MACS_FILE, 'w') as f:
-            json.dump({
-                'authorized_macs': list(authorized_macs),
-                'last_updated': datetime.now().isoformat()
-            }, f, indent=2)
-        print(f"💾 Saved {len(authorized_macs)} authorized MACs to file")
-        
-        # Also update server.py file with new MACs
-        update_server_py_with_macs()
-        
+        with state_lock:
+            macs = sorted(authorized_macs)
+        tmp = AUTHORIZED_MACS_FILE + '.tmp'
+        with auth_file_lock:
+            with open(tmp, 'w') as f:
+                json.dump({
+                    'authorized_macs': macs,
+                    'last_updated': datetime.now().isoformat()
+                }, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())  # Data on disk before the rename makes it visible
+            os.replace(tmp, AUTHORIZED_MACS_FILE)
+        print(f"💾 Saved {len(macs)} authorized MACs to file")
     except Exception as e:
         print(f"❌ Error saving authorized MACs: {e}")
 
-def update_server_py_with_macs():
-    """Update server.py file with current authorized MACs"""
-    try:
-        # Read current server.py
-        with open(__file__, 'r') as f:
-            content = f.read()
-        
-        # Create MAC list string
-        mac_list_str = "[\n"
-        for mac in sorted(authorized_macs):
-            mac_list_str += f'    "{mac}",  # Added via dashboard\n'
-        mac_list_str += "]"
-        
-        # Update the WHITELIST_MACS definition
-        pattern = r'WHITELIST_MACS\s*=\s*\[[^\]]*\]'
-        new_content = re.sub(pattern, f'WHITELIST_MACS = {mac_list_str}', content)
-        
-        # Write back
-        with open(__file__, 'w') as f:
-            f.write(new_content)
-        
-        print(f"📝 Updated server.py with {len(authorized_macs)} authorized MACs")
-    except Exception as e:
-        print(f"⚠️ Could not update server.py: {e}")
+def save_authorized_macs():
+    """Mark authorized MACs for saving by the background flusher"""
+    global auth_flusher
+    # Started here rather than in __main__ so waitress-serve and test clients persist too
+    with auth_flusher_lock:
+        if auth_flusher is None:
+            auth_flusher = threading.Thread(target=auth_flusher_thread, daemon=True, name='auth-flusher')
+            auth_flusher.start()
+    auth_dirty.set()
+
+def auth_flusher_thread(delay=1.0):
+    """Write authorized MACs at most once per delay seconds while they change"""
+    while True:
+        auth_dirty.wait()
+        time.sleep(delay)  # Let a burst of dashboard edits land in one write
+        auth_dirty.clear()
+        flush_authorized_macs()
+
+def flush_pending_authorized_macs():
+    """Write out changes the flusher has not saved yet (on exit)"""
+    if auth_dirty.is_set():
+        auth_dirty.clear()
+        flush_authorized_macs()
+
+atexit.register(flush_pending_authorized_macs)
 
 # Load authorized MACs on startup
 load_authorized_macs()
@@ -102,79 +246,7 @@ HTML = """
     <title>WIDS Dashboard</title>
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #0f172a; color: #f1f5f9; }
-        
-        /* Header */
-        .header { background: linear-gradient(135deg, #1e40af 0%, #1e3a8a 100%); 
-                 padding: 20px; border-bottom: 3px solid #3b82f6; }
-        .header h1 { font-size: 28px; margin-bottom: 5px; }
-        .header p { color: #94a3b8; font-size: 14px; }
-        
-        /* Stats Cards */
-        .stats { display: grid; grid-template-columns: repeat(4, 1fr); gap: 20px; padding: 20px; }
-        .stat-card { background: #1e293b; padding: 20px; border-radius: 10px; border-left: 4px solid #3b82f6; }
-        .stat-card h3 { font-size: 32px; color: #60a5fa; margin-bottom: 5px; }
-        .stat-card p { color: #94a3b8; font-size: 14px; }
-        
-        /* Tabs */
-        .tabs { display: flex; background: #1e293b; margin: 0 20px; border-radius: 10px 10px 0 0; overflow: hidden; }
-        .tab { flex: 1; padding: 15px; text-align: center; cursor: pointer; border-bottom: 3px solid transparent; }
-        .tab.active { background: #334155; border-bottom-color: #3b82f6; }
-        .tab:hover { background: #2d3748; }
-        
-        /* Main Content */
-        .main-content { padding: 0 20px 20px; }
-        .tab-content { display: none; background: #1e293b; border-radius: 0 0 10px 10px; overflow: hidden; }
-        .tab-content.active { display: block; }
-        
-        /* Tables */
-        .panel-header { background: #334155; padding: 15px; border-bottom: 1px solid #475569; }
-        .panel-header h3 { font-size: 18px; }
-        
-        table { width: 100%; border-collapse: collapse; }
-        th { background: #334155; padding: 12px 15px; text-align: left; font-size: 14px; color: #cbd5e1; }
-        td { padding: 12px 15px; border-bottom: 1px solid #334155; }
-        tr:hover { background: #2d3748; }
-        
-        /* Buttons */
-        .btn { border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; font-size: 12px; margin: 2px; }
-        .btn-block { background: #ef4444; color: white; }
-        .btn-unblock { background: #10b981; color: white; }
-        .btn-authorize { background: #3b82f6; color: white; }
-        .btn-unauthorize { background: #f59e0b; color: white; }
-        
-        /* Status badges */
-        .status { padding: 4px 8px; border-radius: 4px; font-size: 12px; font-weight: bold; }
-        .status-authorized { background: #10b98120; color: #10b981; }
-        .status-unauthorized { background: #f59e0b20; color: #f59e0b; }
-        .status-blocked { background: #ef444420; color: #ef4444; }
-        .status-active { background: #3b82f620; color: #3b82f6; }
-        
-        /* Log entries */
-        .log-entry { padding: 10px 15px; border-bottom: 1px solid #334155; font-size: 13px; }
-        .log-entry.info { background: #3b82f610; border-left: 3px solid #3b82f6; }
-        .log-entry.success { background: #10b98110; border-left: 3px solid #10b981; }
-        .log-entry.warning { background: #f59e0b10; border-left: 3px solid #f59e0b; }
-        .log-entry.error { background: #ef444410; border-left: 3px solid #ef4444; }
-        .log-time { color: #94a3b8; font-size: 12px; }
-        .log-message { margin-top: 3px; }
-        
-        /* Forms */
-        .form-group { padding: 15px; }
-        .form-input { width: 100%; padding: 10px; background: #334155; border: 1px solid #475569; border-radius: 4px; color: white; margin-bottom: 10px; }
-        .form-label { display: block; margin-bottom: 5px; color: #cbd5e1; }
-        
-        /* Footer */
-        .footer { text-align: center; padding: 15px; color: #64748b; font-size: 12px; border-top: 1px solid #334155; margin-top: 20px; }
-        
-        /* Refresh button */
-        .refresh-btn { background: #3b82f6; color: white; border: none; padding: 8px 16px; border-radius: 4px; cursor: pointer; margin: 10px; }
-        
-        /* Manual test section */
-        .test-section { background: #1e293b; padding: 20px; margin: 20px; border-radius: 10px; }
-    </style>
+    <link rel="stylesheet" href="/assets/wids.css?v={{ css_version }}">
 </head>
 <body>
     <div class="header">
@@ -253,7 +325,7 @@ HTML = """
             <div class="panel-header">
                 <h3>Authorized MAC Addresses</h3>
                 <p style="color: #94a3b8; font-size: 12px; margin-top: 5px;">
-                    MACs added here will be saved to server.py file
+                    MACs added here will be saved to authorized_macs.json
                 </p>
             </div>
             <div class="form-group">
@@ -306,8 +378,89 @@ HTML = """
         <p>WIDS System v2.0 | Server: {{ server_ip }}:{{ server_port }} | Last Update: <span id="lastUpdate">--:--:--</span></p>
     </div>
     
-    <script>
+    <script src="/assets/wids.js?v={{ js_version }}" defer></script>
+</body>
+</html>
+"""
+
+# Stylesheet and script for the dashboard, served as long-cached /assets files
+DASHBOARD_CSS = """
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #0f172a; color: #f1f5f9; }
+        
+        /* Header */
+        .header { background: linear-gradient(135deg, #1e40af 0%, #1e3a8a 100%); 
+                 padding: 20px; border-bottom: 3px solid #3b82f6; }
+        .header h1 { font-size: 28px; margin-bottom: 5px; }
+        .header p { color: #94a3b8; font-size: 14px; }
+        
+        /* Stats Cards */
+        .stats { display: grid; grid-template-columns: repeat(4, 1fr); gap: 20px; padding: 20px; }
+        .stat-card { background: #1e293b; padding: 20px; border-radius: 10px; border-left: 4px solid #3b82f6; }
+        .stat-card h3 { font-size: 32px; color: #60a5fa; margin-bottom: 5px; }
+        .stat-card p { color: #94a3b8; font-size: 14px; }
+        
+        /* Tabs */
+        .tabs { display: flex; background: #1e293b; margin: 0 20px; border-radius: 10px 10px 0 0; overflow: hidden; }
+        .tab { flex: 1; padding: 15px; text-align: center; cursor: pointer; border-bottom: 3px solid transparent; }
+        .tab.active { background: #334155; border-bottom-color: #3b82f6; }
+        .tab:hover { background: #2d3748; }
+        
+        /* Main Content */
+        .main-content { padding: 0 20px 20px; }
+        .tab-content { display: none; background: #1e293b; border-radius: 0 0 10px 10px; overflow: hidden; }
+        .tab-content.active { display: block; }
+        
+        /* Tables */
+        .panel-header { background: #334155; padding: 15px; border-bottom: 1px solid #475569; }
+        .panel-header h3 { font-size: 18px; }
+        
+        table { width: 100%; border-collapse: collapse; }
+        th { background: #334155; padding: 12px 15px; text-align: left; font-size: 14px; color: #cbd5e1; }
+        td { padding: 12px 15px; border-bottom: 1px solid #334155; }
+        tr:hover { background: #2d3748; }
+        
+        /* Buttons */
+        .btn { border: none; padding: 6px 12px; border-radius: 4px; cursor: pointer; font-size: 12px; margin: 2px; }
+        .btn-block { background: #ef4444; color: white; }
+        .btn-unblock { background: #10b981; color: white; }
+        .btn-authorize { background: #3b82f6; color: white; }
+        .btn-unauthorize { background: #f59e0b; color: white; }
+        
+        /* Status badges */
+        .status { padding: 4px 8px; border-radius: 4px; font-size: 12px; font-weight: bold; }
+        .status-authorized { background: #10b98120; color: #10b981; }
+        .status-unauthorized { background: #f59e0b20; color: #f59e0b; }
+        .status-blocked { background: #ef444420; color: #ef4444; }
+        .status-active { background: #3b82f620; color: #3b82f6; }
+        
+        /* Log entries */
+        .log-entry { padding: 10px 15px; border-bottom: 1px solid #334155; font-size: 13px; }
+        .log-entry.info { background: #3b82f610; border-left: 3px solid #3b82f6; }
+        .log-entry.success { background: #10b98110; border-left: 3px solid #10b981; }
+        .log-entry.warning { background: #f59e0b10; border-left: 3px solid #f59e0b; }
+        .log-entry.error { background: #ef444410; border-left: 3px solid #ef4444; }
+        .log-time { color: #94a3b8; font-size: 12px; }
+        .log-message { margin-top: 3px; }
+        
+        /* Forms */
+        .form-group { padding: 15px; }
+        .form-input { width: 100%; padding: 10px; background: #334155; border: 1px solid #475569; border-radius: 4px; color: white; margin-bottom: 10px; }
+        .form-label { display: block; margin-bottom: 5px; color: #cbd5e1; }
+        
+        /* Footer */
+        .footer { text-align: center; padding: 15px; color: #64748b; font-size: 12px; border-top: 1px solid #334155; margin-top: 20px; }
+        
+        /* Refresh button */
+        .refresh-btn { background: #3b82f6; color: white; border: none; padding: 8px 16px; border-radius: 4px; cursor: pointer; margin: 10px; }
+        
+        /* Manual test section */
+        .test-section { background: #1e293b; padding: 20px; margin: 20px; border-radius: 10px; }
+"""
+
+DASHBOARD_JS = """
         let currentTab = 'devices';
+        const MAC_RE = /^([0-9A-F]{2}:){5}[0-9A-F]{2}$/;
         let activityLog = [];
         
         // Update current time
@@ -339,25 +492,30 @@ HTML = """
             loadTabData(tabName);
         }
         
-        // Load dashboard data
-        async function loadDashboard() {
+        // Load stats cards
+        async function loadStats() {
+            const statsRes = await fetch('/api/stats');
+            if (!statsRes.ok) throw new Error(`HTTP ${statsRes.status}`);
+            const stats = await statsRes.json();
+            
+            document.getElementById('totalDevices').textContent = stats.device_count || 0;
+            document.getElementById('totalPackets').textContent = stats.packet_count || 0;
+            document.getElementById('authorizedDevices').textContent = stats.authorized_count || 0;
+            document.getElementById('unauthorizedDevices').textContent = stats.unauthorized_count || 0;
+        }
+        
+        // Load dashboard data; live updates reload quietly so they don't flood the log
+        async function loadDashboard(quiet = false) {
             try {
                 console.log('Loading dashboard data...');
                 
                 // Load stats
-                const statsRes = await fetch('/api/stats');
-                if (!statsRes.ok) throw new Error(`HTTP ${statsRes.status}`);
-                const stats = await statsRes.json();
-                
-                document.getElementById('totalDevices').textContent = stats.device_count || 0;
-                document.getElementById('totalPackets').textContent = stats.packet_count || 0;
-                document.getElementById('authorizedDevices').textContent = stats.authorized_count || 0;
-                document.getElementById('unauthorizedDevices').textContent = stats.unauthorized_count || 0;
+                await loadStats();
                 
                 // Load current tab data
                 loadTabData(currentTab);
                 
-                addLog('info', 'Dashboard refreshed');
+                if (!quiet) addLog('info', 'Dashboard refreshed');
                 
             } catch (error) {
                 console.error('Error loading dashboard:', error);
@@ -400,10 +558,10 @@ HTML = """
                     return;
                 }
                 
-                tbody.innerHTML = '';
-                
+                // Build rows off-document and swap them in with one insert
+                const frag = document.createDocumentFragment();
                 devices.forEach(device => {
-                    const row = tbody.insertRow();
+                    const row = document.createElement('tr');
                     
                     // Format last seen time
                     const lastSeen = new Date(device.last_seen).toLocaleTimeString();
@@ -432,7 +590,9 @@ HTML = """
                             </button>
                         </td>
                     `;
+                    frag.appendChild(row);
                 });
+                tbody.replaceChildren(frag);
                 
             } catch (error) {
                 console.error('Error loading devices:', error);
@@ -448,7 +608,6 @@ HTML = """
                 const authorized = await authRes.json();
                 
                 const tbody = document.getElementById('authorizedTable');
-                tbody.innerHTML = '';
                 
                 if (authorized.length === 0) {
                     tbody.innerHTML = `
@@ -458,8 +617,9 @@ HTML = """
                     return;
                 }
                 
+                const frag = document.createDocumentFragment();
                 authorized.forEach(mac => {
-                    const row = tbody.insertRow();
+                    const row = document.createElement('tr');
                     row.innerHTML = `
                         <td><code style="font-family: monospace;">${mac.mac}</code></td>
                         <td><span class="status status-authorized">AUTHORIZED</span></td>
@@ -469,7 +629,9 @@ HTML = """
                             </button>
                         </td>
                     `;
+                    frag.appendChild(row);
                 });
+                tbody.replaceChildren(frag);
                 
             } catch (error) {
                 console.error('Error loading authorized MACs:', error);
@@ -485,7 +647,6 @@ HTML = """
                 const packets = await packetsRes.json();
                 
                 const logDiv = document.getElementById('packetLog');
-                logDiv.innerHTML = '';
                 
                 if (packets.length === 0) {
                     logDiv.innerHTML = `
@@ -496,6 +657,7 @@ HTML = """
                     return;
                 }
                 
+                const frag = document.createDocumentFragment();
                 packets.forEach(packet => {
                     const entry = document.createElement('div');
                     entry.className = 'log-entry info';
@@ -508,8 +670,9 @@ HTML = """
                         </div>
                     `;
                     
-                    logDiv.appendChild(entry);
+                    frag.appendChild(entry);
                 });
+                logDiv.replaceChildren(frag);
                 
             } catch (error) {
                 console.error('Error loading packets:', error);
@@ -525,7 +688,7 @@ HTML = """
             const resultDiv = document.getElementById('testResult');
             
             // Validate MAC
-            if (!mac.match(/^([0-9A-F]{2}:){5}[0-9A-F]{2}$/)) {
+            if (!MAC_RE.test(mac)) {
                 resultDiv.innerHTML = '<span style="color: #ef4444;">❌ Invalid MAC format. Use AA:BB:CC:DD:EE:FF</span>';
                 return;
             }
@@ -571,7 +734,7 @@ HTML = """
             const macInput = document.getElementById('newMac');
             const mac = macInput.value.trim().toUpperCase();
             
-            if (!mac.match(/^([0-9A-F]{2}:){5}[0-9A-F]{2}$/)) {
+            if (!MAC_RE.test(mac)) {
                 alert('Invalid MAC address format. Use AA:BB:CC:DD:EE:FF');
                 return;
             }
@@ -590,7 +753,7 @@ HTML = """
                     loadDashboard();
                     
                     // Show success message
-                    alert(`✅ MAC ${mac} added to authorized list and saved to server.py`);
+                    alert(`✅ MAC ${mac} added to authorized list and saved`);
                 } else {
                     alert(`❌ Error: ${result.error || 'Failed to authorize MAC'}`);
                     addLog('error', `Failed to authorize MAC: ${result.error}`);
@@ -687,23 +850,118 @@ HTML = """
             if (activityLog.length > 100) activityLog.pop();
         }
         
-        // Auto-refresh every 5 seconds
-        setInterval(loadDashboard, 5000);
+        // Auto-refresh every 5 seconds when live updates are unavailable
+        let updateTimer;
+        function startPolling() {
+            if (!updateTimer) updateTimer = setInterval(loadDashboard, 5000);
+        }
+        
+        // Live updates: the server pushes the names of what changed; only the open tab reloads
+        const TAB_EVENTS = {
+            devices: ['packets', 'authorized'],
+            authorized: ['authorized'],
+            packets: ['packets'],
+            logs: []
+        };
+        
+        if (window.EventSource) {
+            const events = new EventSource('/api/events');
+            events.onmessage = (e) => {
+                const kinds = JSON.parse(e.data);
+                if (kinds.some(kind => TAB_EVENTS[currentTab].includes(kind))) {
+                    loadDashboard(true);
+                } else {
+                    loadStats().catch(error => console.error('Error loading stats:', error));
+                }
+            };
+            events.onerror = () => {
+                events.close();
+                startPolling();
+            };
+        } else {
+            startPolling();
+        }
         
         // Initial load
         loadDashboard();
         addLog('info', 'Dashboard loaded successfully');
         addLog('info', 'Send test packets using the manual test section');
-    </script>
-</body>
-</html>
 """
 
 # ========== ROUTES ==========
+def precompress(text):
+    """(body, gzipped body, etag) for a page or asset"""
+    body = text.encode('utf-8')
+    return body, gzip.compress(body, 6), hashlib.sha1(body).hexdigest()
+
+def cached_response(page, mimetype, max_age):
+    """Serve a precompress() result, gzipped if accepted, honoring If-None-Match"""
+    body, body_gz, etag = page
+    
+    # Send the pre-compressed copy to clients that accept gzip
+    if 'gzip' in request.accept_encodings:
+        response = app.response_class(body_gz, mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(etag + '-gz')
+    else:
+        response = app.response_class(body, mimetype=mimetype)
+        response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+# Asset URLs carry a content hash, so browsers may keep them for a year
+dashboard_assets = {
+    'wids.css': (precompress(DASHBOARD_CSS), 'text/css'),
+    'wids.js': (precompress(DASHBOARD_JS), 'text/javascript'),
+}
+
+dashboard_template = app.jinja_env.from_string(HTML)  # Compiled once at import
+dashboard_page = None  # (html, gzipped html, etag), cached once get_ip() has succeeded
+
+def render_dashboard():
+    """Render the dashboard and pre-compress it"""
+    return precompress(dashboard_template.render(
+        server_ip=get_ip(), server_port=8000,
+        css_version=dashboard_assets['wids.css'][0][2][:12],
+        js_version=dashboard_assets['wids.js'][0][2][:12]))
+
+def revalidated_json(obj, etag):
+    """JSON response the browser caches but must revalidate by ETag on every fetch"""
+    response = jsonify(obj)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag):
+    """Empty 304 for a client whose copy matches etag"""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/')
 def dashboard():
     """Main dashboard page"""
-    return render_template_string(HTML, server_ip=get_ip(), server_port=8000)
+    global dashboard_page
+    page = dashboard_page
+    if page is None:
+        page = render_dashboard()
+        if server_ip is not None:
+            dashboard_page = page
+    return cached_response(page, 'text/html', 300)
+
+@app.route('/assets/<name>')
+def dashboard_asset(name):
+    """Dashboard stylesheet and script"""
+    asset = dashboard_assets.get(name)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    page, mimetype = asset
+    response = cached_response(page, mimetype, 31536000)
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/packet', methods=['POST'])
 def receive_packet():
@@ -714,49 +972,49 @@ def receive_packet():
             return jsonify({'error': 'No data'}), 400
         
         client_ip = request.remote_addr
-        mac = data.get('mac', '00:00:00:00:00:00')
+        mac = canonical_mac(data.get('mac', '00:00:00:00:00:00'))
+        data['mac'] = mac
         sensor_id = data.get('sensor_id', 'unknown')
         
-        print(f"📦 Packet received from {client_ip}")
-        print(f"   MAC: {mac}, RSSI: {data.get('rssi')}, Channel: {data.get('channel')}")
-        
-        # Add timestamp
-        data['received_at'] = datetime.now().isoformat()
+        # Add timestamp (one clock read shared by every field below)
+        now = time.time()
+        now_iso = datetime.fromtimestamp(now).isoformat()
+        data['received_at'] = now_iso
         data['client_ip'] = client_ip
-        data['timestamp'] = datetime.now().isoformat()
+        data['timestamp'] = now_iso
         
-        # Store packet
-        packets.append(data)
-        
-        # Keep last 100 packets only
-        if len(packets) > 100:
-            packets.pop(0)
-        
-        # Update device info
-        if mac not in devices:
-            devices[mac] = {
-                'mac': mac,
-                'first_seen': datetime.now().isoformat(),
-                'last_seen': datetime.now().isoformat(),
-                'packet_count': 1,
-                'rssi': data.get('rssi', -99),
-                'channel': data.get('channel', 0),
-                'authorized': mac in authorized_macs,
-                'sensor': sensor_id
-            }
-            print(f"🆕 New device detected: {mac}")
-        else:
-            devices[mac]['last_seen'] = datetime.now().isoformat()
-            devices[mac]['packet_count'] += 1
-            devices[mac]['rssi'] = data.get('rssi', devices[mac]['rssi'])
-            devices[mac]['channel'] = data.get('channel', devices[mac]['channel'])
+        with state_lock:
+            # Store packet
+            packets.append(data)
+            
+            # Update device info
+            device = devices.get(mac)
+            new_device = device is None
+            if new_device:
+                device = devices[mac] = Device(mac, now, now_iso,
+                                               data.get('rssi', -99),
+                                               data.get('channel', 0),
+                                               mac in authorized_macs,
+                                               sensor_id)
+            else:
+                device.last_seen = now_iso
+                device.last_seen_ts = now
+                device.packet_count += 1
+                device.rssi = data.get('rssi', device.rssi)
+                device.channel = data.get('channel', device.channel)
+            mark_active(mac)
+            authorized = device.authorized  # Kept in step with authorized_macs under the lock
+        publish_event('packets')
         
-        print(f"✅ Packet #{len(packets)} stored successfully")
+        if new_device:
+            log.info("🆕 New device detected: %s", mac)
+        log.debug("📦 Packet from %s | MAC: %s, RSSI: %s, Channel: %s",
+                  client_ip, mac, data.get('rssi'), data.get('channel'))
         
         return jsonify({
             'status': 'received',
             'packet_id': len(packets),
-            'authorized': mac in authorized_macs,
+            'authorized': authorized,
             'message': f'Packet from {mac} received successfully'
         })
         
@@ -764,36 +1022,88 @@ def receive_packet():
         print(f"❌ Error processing packet: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/events')
+def event_stream():
+    """Server-Sent Events naming the data that changed (see PACKET_EVENT_INTERVAL)"""
+    q = queue.Queue(maxsize=100)
+    with subscribers_lock:
+        if len(event_subscribers) >= MAX_EVENT_SUBSCRIBERS:
+            return jsonify({'error': 'Too many live dashboards, poll instead'}), 503
+        event_subscribers.add(q)
+    
+    def stream():
+        yield "retry: 5000\n\n"
+        kinds = set()       # Changes not sent yet
+        packets_due = 0.0   # Earliest time another 'packets' event may go out
+        while True:
+            # Only throttled packet news waiting: sleep until it is due
+            wait = packets_due - time.time() if kinds == {'packets'} else 15
+            try:
+                kinds.add(q.get(timeout=max(wait, 0)))
+            except queue.Empty:
+                if not kinds:
+                    yield ": keepalive\n\n"
+                    continue
+            else:
+                # Fold a burst of changes into one event
+                time.sleep(1)
+                while True:
+                    try:
+                        kinds.add(q.get_nowait())
+                    except queue.Empty:
+                        break
+            
+            now = time.time()
+            if kinds == {'packets'} and now < packets_due:
+                continue
+            if 'packets' in kinds:
+                packets_due = now + PACKET_EVENT_INTERVAL
+            yield f"data: {json.dumps(sorted(kinds))}\n\n"
+            kinds = set()
+    
+    def unsubscribe():
+        with subscribers_lock:
+            event_subscribers.discard(q)
+    
+    response = app.response_class(stream(), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache'})
+    response.call_on_close(unsubscribe)
+    return response
+
 @app.route('/api/devices')
 def get_devices():
     """Get list of all detected devices"""
-    device_list = []
-    
-    for mac, info in devices.items():
-        # Only include devices seen in last hour
-        last_seen = datetime.fromisoformat(info['last_seen'].replace('Z', '+00:00'))
-        if datetime.now() - last_seen < timedelta(hours=1):
+    # Only devices seen in last hour; active_devices is already ordered by
+    # last seen, so walking it backwards gives newest first without a sort
+    with state_lock:
+        expire_active(time.time())
+        # Expiry only shrinks active_devices between revisions, so its size
+        # tells apart lists with the same revision
+        etag = f"{STATE_EPOCH}-{devices_rev}-{len(active_devices)}"
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        device_list = []
+        for mac in reversed(active_devices):
+            info = devices[mac]
             device_list.append({
                 'mac': mac,
-                'first_seen': info['first_seen'],
-                'last_seen': info['last_seen'],
-                'packet_count': info['packet_count'],
-                'rssi': info.get('rssi', -99),
-                'channel': info.get('channel', 0),
-                'authorized': info.get('authorized', False),
-                'sensor': info.get('sensor', 'unknown')
+                'first_seen': info.first_seen,
+                'last_seen': info.last_seen,
+                'packet_count': info.packet_count,
+                'rssi': info.rssi,
+                'channel': info.channel,
+                'authorized': info.authorized,
+                'sensor': info.sensor
             })
     
-    # Sort by last seen (newest first)
-    device_list.sort(key=lambda x: x['last_seen'], reverse=True)
-    
-    return jsonify(device_list)
+    return revalidated_json(device_list, etag)
 
 @app.route('/api/packets')
 def get_packets():
     """Get recent packets"""
-    # Return last 50 packets
-    recent_packets = packets[-50:]
+    # Return last 50 packets, newest first
+    with state_lock:
+        recent_packets = list(islice(reversed(packets), 50))
     
     # Format for display
     formatted_packets = []
@@ -806,36 +1116,44 @@ def get_packets():
             'sensor': p.get('sensor_id', 'unknown')
         })
     
-    return jsonify(formatted_packets[::-1])  # Reverse to show newest first
+    return jsonify(formatted_packets)
 
 @app.route('/api/authorized')
 def get_authorized():
     """Get list of authorized MACs"""
+    with state_lock:
+        etag = f"{STATE_EPOCH}-{authorized_rev}"
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        macs = sorted(authorized_macs)
     auth_list = []
-    for mac in sorted(authorized_macs):
+    for mac in macs:
         auth_list.append({
             'mac': mac,
-            'added_at': 'From server.py'  # Could store actual timestamps
+            'added_at': 'From file'  # Could store actual timestamps
         })
-    return jsonify(auth_list)
+    return revalidated_json(auth_list, etag)
 
 @app.route('/api/authorize/<mac>', methods=['POST'])
 def authorize_mac(mac):
     """Add MAC to authorized list"""
-    mac_upper = mac.upper()
+    mac_upper = canonical_mac(mac)
     
     # Validate MAC format
-    if not re.match(r'^([0-9A-F]{2}:){5}[0-9A-F]{2}$', mac_upper):
+    if not MAC_RE.fullmatch(mac_upper):
         return jsonify({'error': 'Invalid MAC format'}), 400
     
-    authorized_macs.add(mac_upper)
-    
-    # Update device if it exists
-    if mac_upper in devices:
-        devices[mac_upper]['authorized'] = True
+    global authorized_rev
+    with state_lock:
+        authorized_macs.add(mac_upper)
+        authorized_rev += 1
+        
+        # Update device if it exists
+        set_device_authorized(mac_upper, True)
     
-    # Save to file and update server.py
+    # Save to file
     save_authorized_macs()
+    publish_event('authorized')
     
     print(f"✅ Authorized MAC: {mac_upper} (saved to file)")
     return jsonify({'status': 'authorized', 'mac': mac_upper})
@@ -843,15 +1161,21 @@ def authorize_mac(mac):
 @app.route('/api/unauthorize/<mac>', methods=['POST'])
 def unauthorize_mac(mac):
     """Remove MAC from authorized list"""
-    mac_upper = mac.upper()
-    authorized_macs.discard(mac_upper)
+    mac_upper = canonical_mac(mac)
+    if not MAC_RE.fullmatch(mac_upper):
+        return jsonify({'error': 'Invalid MAC format'}), 400
     
-    # Update device if it exists
-    if mac_upper in devices:
-        devices[mac_upper]['authorized'] = False
+    global authorized_rev
+    with state_lock:
+        authorized_macs.discard(mac_upper)
+        authorized_rev += 1
+        
+        # Update device if it exists
+        set_device_authorized(mac_upper, False)
     
-    # Save to file and update server.py
+    # Save to file
     save_authorized_macs()
+    publish_event('authorized')
     
     print(f"⚠️ Unauthorized MAC: {mac_upper} (updated in file)")
     return jsonify({'status': 'unauthorized', 'mac': mac_upper})
@@ -859,21 +1183,25 @@ def unauthorize_mac(mac):
 @app.route('/api/device/<mac>/toggle_auth', methods=['POST'])
 def toggle_authorization(mac):
     """Toggle authorization status"""
-    mac_upper = mac.upper()
+    mac_upper = canonical_mac(mac)
+    if not MAC_RE.fullmatch(mac_upper):
+        return jsonify({'error': 'Invalid MAC format'}), 400
     
-    if mac_upper in authorized_macs:
-        authorized_macs.discard(mac_upper)
-        status = 'unauthorized'
-        if mac_upper in devices:
-            devices[mac_upper]['authorized'] = False
-    else:
-        authorized_macs.add(mac_upper)
-        status = 'authorized'
-        if mac_upper in devices:
-            devices[mac_upper]['authorized'] = True
+    global authorized_rev
+    with state_lock:
+        authorized_rev += 1
+        if mac_upper in authorized_macs:
+            authorized_macs.discard(mac_upper)
+            status = 'unauthorized'
+            set_device_authorized(mac_upper, False)
+        else:
+            authorized_macs.add(mac_upper)
+            status = 'authorized'
+            set_device_authorized(mac_upper, True)
     
     # Save to file
     save_authorized_macs()
+    publish_event('authorized')
     
     print(f"🔄 Toggled authorization for {mac_upper}: {status}")
     return jsonify({'status': status, 'authorized': status == 'authorized', 'mac': mac_upper})
@@ -881,26 +1209,25 @@ def toggle_authorization(mac):
 @app.route('/api/reload_authorized', methods=['POST'])
 def reload_authorized():
     """Reload authorized MACs from file"""
+    global authorized_rev
     load_authorized_macs()
+    with state_lock:
+        authorized_rev += 1
+        for mac in devices:
+            set_device_authorized(mac, mac in authorized_macs)
+    publish_event('authorized')
     print("🔄 Reloaded authorized MACs from file")
     return jsonify({'status': 'reloaded', 'count': len(authorized_macs)})
 
 @app.route('/api/stats')
 def get_stats():
     """Get system statistics"""
-    # Count devices by status
-    total_devices = 0
-    authorized_count = 0
-    unauthorized_count = 0
-    
-    for info in devices.values():
-        last_seen = datetime.fromisoformat(info['last_seen'].replace('Z', '+00:00'))
-        if datetime.now() - last_seen < timedelta(hours=1):
-            total_devices += 1
-            if info.get('authorized'):
-                authorized_count += 1
-            else:
-                unauthorized_count += 1
+    # Count devices seen in the last hour by status
+    with state_lock:
+        expire_active(time.time())
+        total_devices = len(active_devices)
+        authorized_count = active_authorized
+    unauthorized_count = total_devices - authorized_count
     
     return jsonify({
         'device_count': total_devices,
@@ -925,18 +1252,22 @@ def test_endpoint():
     })
 
 # ========== UTILITIES ==========
+server_ip = None  # Cached by get_ip() once a lookup succeeds
+
 def get_ip():
     """Get server IP address"""
-    import socket
+    global server_ip
+    if server_ip is not None:
+        return server_ip
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(('8.8.8.8', 80))
-        ip = s.getsockname()[0]
+        server_ip = s.getsockname()[0]
+        return server_ip
     except:
-        ip = '127.0.0.1'
+        return '127.0.0.1'
     finally:
         s.close()
-    return ip
 
 # ========== MAIN ==========
 if __name__ == '__main__':
@@ -950,13 +1281,20 @@ if __name__ == '__main__':
     print("  • Dashboard shows real-time devices")
     print("  • Manual packet testing section")
     print("  • MAC authorization management")
-    print("  • Authorized MACs saved to server.py file")
+    print(f"  • Authorized MACs saved to {AUTHORIZED_MACS_FILE}")
     print("\n🔧 To test the system:")
     print("  1. Open dashboard in browser")
     print("  2. Use 'Manual Packet Test' section")
     print("  3. Add MACs to authorized list")
-    print("  4. MACs are saved to server.py automatically")
+    print(f"  4. MACs are saved to {AUTHORIZED_MACS_FILE} automatically")
     print("\n⏳ Waiting for ESP32 packets...")
     print("="*70 + "\n")
     
-    app.run(host='0.0.0.0', port=8000, debug=True)
+    # Run Flask under waitress if available, else the Werkzeug dev server
+    try:
+        from waitress import serve
+        print("🍽️ Serving with waitress (8 threads)")
+        serve(app, host='0.0.0.0', port=8000, threads=8)
+    except ImportError:
+        print("⚠️ waitress not installed, using Flask dev server (pip3 install waitress)")
+        app.run(host='0.0.0.0', port=8000, debug=False, threaded=True)
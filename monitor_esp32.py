@@ -11,9 +11,30 @@ import requests
 import sys
 import os
 import threading
+import queue
 from datetime import datetime
 import re
 
+# Every field of a packet line in one scan; the named group that matched
+# says which field it is, and labeled values win over bare ones
+PACKET_FIELD_RE = re.compile(
+    r'MAC:(?P<mac>[0-9A-F:]{17})'
+    r'|(?P<bare_mac>[0-9A-F]{2}(?::[0-9A-F]{2}){5})'
+    r'|RSSI:(?P<rssi>-?\d+)'
+    r'|(?P<dbm>-?\d+)(?-i:dBm)'
+    r'|CHANNEL:(?P<channel>\d+)'
+    r'|CH:(?P<ch>\d+)',  # Also matches "Ch:"
+    re.IGNORECASE)
+
+# Every marker process_line looks for, found in one scan of the line
+LINE_MARKER_RE = re.compile(
+    r'(?P<ready>ESP32_WIDS_READY)'
+    r'|(?P<wifi>WiFi Connected)'
+    r'|(?P<response>Server response:)'
+    r'|(?P<detected>DETECTED DEVICE:)'
+    r'|(?P<mac>MAC:)'
+    r'|(?P<rssi>RSSI:)')
+
 class ESP32Monitor:
     def __init__(self, port='/dev/ttyUSB0', server_url='http://192.168.1.3:8000'):
         self.port = port
@@ -23,6 +44,9 @@ class ESP32Monitor:
         self.ready = False
         self.packet_count = 0
         self.devices_detected = set()
+        self.session = requests.Session()  # Keeps the server connection open between packets
+        self.forward_queue = queue.Queue(maxsize=1024)  # Parsed packets waiting for the forwarder
+        self.packets_dropped = 0  # Oldest packets discarded while the server was too slow
         
     def connect(self):
         """Connect to ESP32 with CH340"""
@@ -94,7 +118,7 @@ class ESP32Monitor:
     def forward_to_server(self, packet_data):
         """Forward packet to WIDS server"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.server_url,
                 json=packet_data,
                 timeout=3
@@ -108,34 +132,61 @@ class ESP32Monitor:
         except requests.exceptions.RequestException as e:
             return False, str(e)
     
+    def queue_packet(self, packet):
+        """Hand a packet to the forwarder, dropping the oldest one if it is backed up"""
+        while True:
+            try:
+                self.forward_queue.put_nowait(packet)
+                return
+            except queue.Full:
+                try:
+                    self.forward_queue.get_nowait()
+                    self.packets_dropped += 1
+                except queue.Empty:
+                    pass
+    
+    def forward_worker(self):
+        """Forward queued packets so serial reads never wait on the network"""
+        while True:
+            packet = self.forward_queue.get()
+            if packet is None:
+                break
+            
+            success, result = self.forward_to_server(packet)
+            
+            if packet['type'] == 'system':
+                if success:
+                    print("📨 Server notified of ready status")
+                else:
+                    print(f"⚠️ Could not notify server: {result}")
+            elif success:
+                self.packet_count += 1
+                print(f"   ✅ Forwarded: {packet['mac']} (Total: {self.packet_count})")
+            else:
+                print(f"   ❌ Failed: {result}")
+    
     def parse_packet_line(self, line):
         """Parse human-readable packet line"""
         # Example: "🎯 DETECTED DEVICE: MAC:AA:BB:CC:DD:EE:FF RSSI:-65dBm CHANNEL:6"
         
+        # First value of each field in the line
+        fields = {}
+        for match in PACKET_FIELD_RE.finditer(line):
+            fields.setdefault(match.lastgroup, match.group(match.lastgroup))
+        
         # Look for MAC address pattern
-        mac_match = re.search(r'MAC:([0-9A-F:]{17})', line, re.IGNORECASE)
-        if not mac_match:
-            # Try another pattern
-            mac_match = re.search(r'([0-9A-F]{2}:[0-9A-F]{2}:[0-9A-F]{2}:[0-9A-F]{2}:[0-9A-F]{2}:[0-9A-F]{2})', line, re.IGNORECASE)
+        mac = fields.get('mac') or fields.get('bare_mac')
         
-        if mac_match:
-            mac = mac_match.group(1).upper()
+        if mac:
+            mac = mac.upper()
             
             # Extract RSSI
-            rssi_match = re.search(r'RSSI:(-?\d+)', line, re.IGNORECASE)
-            if not rssi_match:
-                rssi_match = re.search(r'(-?\d+)dBm', line)
-            
-            rssi = int(rssi_match.group(1)) if rssi_match else -99
+            rssi = fields.get('rssi') or fields.get('dbm')
+            rssi = int(rssi) if rssi else -99
             
             # Extract channel
-            channel_match = re.search(r'CHANNEL:(\d+)', line, re.IGNORECASE)
-            if not channel_match:
-                channel_match = re.search(r'CH:(\d+)', line, re.IGNORECASE)
-            if not channel_match:
-                channel_match = re.search(r'Ch:(\d+)', line, re.IGNORECASE)
-            
-            channel = int(channel_match.group(1)) if channel_match else 0
+            channel = fields.get('channel') or fields.get('ch')
+            channel = int(channel) if channel else 0
             
             # Determine packet type
             packet_type = "detected"
@@ -164,8 +215,10 @@ class ESP32Monitor:
         # Print to console
         print(f"[{timestamp}] {line}")
         
+        markers = {match.lastgroup for match in LINE_MARKER_RE.finditer(line)}
+        
         # Check for ready signal
-        if "ESP32_WIDS_READY" in line and not self.ready:
+        if 'ready' in markers and not self.ready:
             print("\n" + "="*60)
             print("✅ ESP32 WIDS IS READY AND CAPTURING PACKETS!")
             print("="*60)
@@ -175,15 +228,15 @@ class ESP32Monitor:
             self.send_ready_notification()
         
         # Check for WiFi status
-        elif "WiFi Connected" in line or "✅ WiFi Connected" in line:
+        elif 'wifi' in markers:
             print("🌐 WiFi connection established")
         
         # Check for server response
-        elif "Server response:" in line or "✅ Server response:" in line:
+        elif 'response' in markers:
             print("📡 Packet successfully sent to server")
         
         # Check for packets
-        elif ("MAC:" in line and "RSSI:" in line) or ("DETECTED DEVICE:" in line):
+        elif ('mac' in markers and 'rssi' in markers) or 'detected' in markers:
             print("📦 Packet detected - forwarding to server...")
             
             # Parse packet
@@ -191,19 +244,13 @@ class ESP32Monitor:
             if packet:
                 self.devices_detected.add(packet['mac'])
                 
-                # Forward to server
-                success, result = self.forward_to_server(packet)
-                
-                if success:
-                    self.packet_count += 1
-                    print(f"   ✅ Forwarded: {packet['mac']} (Total: {self.packet_count})")
-                else:
-                    print(f"   ❌ Failed: {result}")
+                # Forward to server (from the forwarder thread)
+                self.queue_packet(packet)
             else:
                 print(f"   ⚠️ Could not parse packet: {line[:50]}...")
     
     def send_ready_notification(self):
-        """Send ready notification to server"""
+        """Queue ready notification for the server"""
         try:
             ready_packet = {
                 "sensor_id": "esp32_monitor",
@@ -215,11 +262,7 @@ class ESP32Monitor:
                 "message": "ESP32 WIDS system is ready and monitoring"
             }
             
-            success, result = self.forward_to_server(ready_packet)
-            if success:
-                print("📨 Server notified of ready status")
-            else:
-                print(f"⚠️ Could not notify server: {result}")
+            self.queue_packet(ready_packet)
                 
         except Exception as e:
             print(f"Error sending ready notification: {e}")
@@ -236,43 +279,40 @@ class ESP32Monitor:
         
         self.running = True
         
+        # Forward packets from a separate thread
+        forwarder = threading.Thread(target=self.forward_worker, daemon=True, name='forwarder')
+        forwarder.start()
+        
         # Clear initial data
         self.ser.reset_input_buffer()
         
-        # Buffer for incomplete lines
-        buffer = ""
+        # Bytes of an incomplete line (decoded only once the line is complete,
+        # so a UTF-8 character split across reads is not lost)
+        buffer = b""
         
         try:
             while self.running:
-                if self.ser.in_waiting:
-                    try:
-                        # Read raw data
-                        raw_data = self.ser.read(self.ser.in_waiting)
+                try:
+                    # Block until data arrives (or the port's read timeout passes);
+                    # pyserial waits in select() on POSIX, so there is no polling
+                    raw_data = self.ser.read(self.ser.in_waiting or 1)
+                    if not raw_data:
+                        continue
+                    if self.ser.in_waiting:
+                        raw_data += self.ser.read(self.ser.in_waiting)
+                    
+                    # Split off complete lines in one pass; the tail stays buffered
+                    *lines, buffer = (buffer + raw_data).split(b'\n')
+                    
+                    for raw_line in lines:
+                        line = raw_line.decode('utf-8', errors='ignore').strip()
                         
-                        # Decode to text
-                        try:
-                            text = raw_data.decode('utf-8', errors='ignore')
-                            
-                            # Add to buffer
-                            buffer += text
-                            
-                            # Process complete lines
-                            while '\n' in buffer:
-                                line, buffer = buffer.split('\n', 1)
-                                line = line.strip()
-                                
-                                if line:
-                                    self.process_line(line)
+                        if line:
+                            self.process_line(line)
                         
-                        except UnicodeDecodeError:
-                            # Skip invalid UTF-8
-                            pass
-                            
-                    except Exception as e:
-                        print(f"⚠️ Read error: {e}")
-                
-                # Small delay to prevent CPU overload
-                time.sleep(0.01)
+                except Exception as e:
+                    print(f"⚠️ Read error: {e}")
+                    time.sleep(1)  # e.g. unplugged; don't spin on a failing port
         
         except KeyboardInterrupt:
             print("\n🛑 Monitoring stopped by user")
@@ -285,11 +325,16 @@ class ESP32Monitor:
             if self.ser:
                 self.ser.close()
             
+            # Let the forwarder finish what is queued (briefly, if the server is down)
+            self.queue_packet(None)
+            forwarder.join(timeout=5)
+            
             # Print summary
             print("\n" + "="*60)
             print("📊 MONITORING SUMMARY")
             print("="*60)
             print(f"Total packets forwarded: {self.packet_count}")
+            print(f"Packets dropped (queue full): {self.packets_dropped}")
             print(f"Unique devices detected: {len(self.devices_detected)}")
             print(f"ESP32 ready: {'Yes' if self.ready else 'No'}")
             print("="*60)
@@ -3,8 +3,9 @@
 WIDS SERVER WITH AUTO-BLOCKING & EMAIL NOTIFICATIONS
 Run with: sudo python3 server.py
 """
-from flask import Flask, request, jsonify, render_template_string
-from datetime import datetime, timedelta
+from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
+from datetime import datetime
 import json
 import subprocess
 import threading
@@ -15,10 +16,45 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import sqlite3
-from collections import defaultdict
+from collections import deque
 import socket
+import sys
+import atexit
+import queue
+import logging
+import logging.handlers
+import gzip
+import hashlib
+
+try:
+    import orjson  # Optional: faster JSON encoding/decoding for the API
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Same argument rules as jsonify(), encoded straight to bytes
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if kwargs:
+            obj = kwargs
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = list(args) or None
+        return self._app.response_class(orjson.dumps(obj, default=self.default),
+                                        mimetype=self.mimetype)
 
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 
 # ========== CONFIGURATION - CHANGE THESE VALUES ==========
 YOUR_SSID = "Airtel_sath_0300"  # Your router SSID to protect
@@ -38,14 +74,62 @@ AUTHORIZED_MACS_FILE = "authorized_macs.json"
 DB_FILE = "wids_database.db"
 BLOCK_LOG_FILE = "blocked_devices.log"
 DASHBOARD_FILE = "dashboard.html"
+IPSET_NAME = "wids_block"            # hash:mac set matched by the DROP rules
+IPSET_SAVE_FILE = "/etc/ipset.conf"
+IPTABLES = ["iptables", "-w", "5"]   # Wait for the xtables lock instead of failing
+
+# Per-MAC DROP rules older versions added to INPUT/FORWARD (as printed by iptables -S)
+LEGACY_RULE_RE = re.compile(r'^-A (INPUT|FORWARD) -m mac --mac-source ([0-9A-Fa-f:]{17}) -j DROP$', re.M)
+
+# Per-packet log lines are DEBUG; set to logging.DEBUG to see every packet
+LOG_LEVEL = logging.INFO
+
+# MAC addresses accepted from the API, after upper-casing
+MAC_RE = re.compile(r'[0-9A-F]{2}(:[0-9A-F]{2}){5}')  # Use fullmatch: $ would also accept a trailing newline
+
+# ========== LOGGING ==========
+# Request threads only put records on a queue; one listener thread writes them
+log = logging.getLogger('wids')
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+log_queue = queue.SimpleQueue()
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # ========== DATA STORAGE ==========
-devices = {}          # MAC -> device info
-packets = []          # Recent packets (limit 1000)
-authorized_macs = set()  # Authorized MACs from file
+# Device info, one dict per field keyed by MAC key (device_last_seen holds every MAC)
+device_first_seen = {}    # MAC -> epoch seconds
+device_last_seen = {}     # MAC -> epoch seconds
+device_packet_count = {}  # MAC -> packets seen
+device_rssi = {}          # MAC -> last RSSI
+device_channel = {}       # MAC -> channel
+device_attack_types = {}  # MAC -> set of attack types
+packets = deque(maxlen=1000)    # Recent packets as (mac, rssi, channel, attack_type, ssid, received_at) rows
+packet_total = 0      # Packets received since start (packets keeps only the latest)
+packet_total_lock = threading.Lock()
+authorized_macs = set()  # Authorized MAC keys (see mac_key) from file
 sensors = {}          # Sensor info
-threat_log = []       # Threat detection log (limit 100)
-packet_rates = defaultdict(list)
+threat_log = deque(maxlen=500)  # Threats as (time, mac, type, reason, rssi) rows
+blocked_macs = set()  # Blocked MAC keys (mirrors status='blocked' rows)
+blocked_lock = threading.Lock()
+device_locks = [threading.Lock() for _ in range(16)]  # Shards per-MAC device updates (see device_lock)
+
+# ========== LIVE UPDATES ==========
+MAX_EVENT_SUBSCRIBERS = 4  # Each open stream holds a server thread; extra dashboards poll
+PACKET_EVENT_INTERVAL = 5.0  # Packets arrive constantly; tell a dashboard at most this often (the old poll rate)
+event_subscribers = set()  # One queue of changed-data names per /api/events stream
+subscribers_lock = threading.Lock()
+
+def publish_event(kind):
+    """Tell every open dashboard stream that one kind of data changed"""
+    with subscribers_lock:
+        for q in event_subscribers:
+            try:
+                q.put_nowait(kind)
+            except queue.Full:
+                pass  # Stream is behind; it refreshes everything it has queued anyway
 
 # ========== LOAD CONFIG ==========
 def load_authorized_macs():
@@ -55,7 +139,7 @@ def load_authorized_macs():
         if os.path.exists(AUTHORIZED_MACS_FILE):
             with open(AUTHORIZED_MACS_FILE, 'r') as f:
                 data = json.load(f)
-                authorized_macs = set(data.get('authorized_macs', []))
+                authorized_macs = {key for key in map(mac_key, data.get('authorized_macs', [])) if key}
             print(f"✅ Loaded {len(authorized_macs)} authorized MACs")
         else:
             authorized_macs = set()
@@ -66,14 +150,21 @@ def load_authorized_macs():
         print(f"❌ Error loading authorized MACs: {e}")
         authorized_macs = set()
 
+authorized_file_lock = threading.Lock()  # One writer of the temp file at a time
+
 def save_authorized_macs():
-    """Save authorized MACs to file"""
+    """Save authorized MACs to file (temp file + fsync + rename, so it is never half-written)"""
     try:
-        with open(AUTHORIZED_MACS_FILE, 'w') as f:
-            json.dump({
-                'authorized_macs': list(authorized_macs),
-                'updated': datetime.now().isoformat()
-            }, f, indent=2)
+        tmp = AUTHORIZED_MACS_FILE + '.tmp'
+        with authorized_file_lock:
+            with open(tmp, 'w') as f:
+                json.dump({
+                    'authorized_macs': sorted(mac_str(key) for key in authorized_macs),
+                    'updated': datetime.now().isoformat()
+                }, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, AUTHORIZED_MACS_FILE)
         print(f"💾 Saved {len(authorized_macs)} authorized MACs")
         return True
     except Exception as e:
@@ -81,33 +172,81 @@ def save_authorized_macs():
         return False
 
 # ========== DATABASE FUNCTIONS ==========
+db_conn = None              # Shared SQLite connection (opened by get_db)
+db_lock = threading.Lock()  # Serializes access to db_conn across threads
+
+def get_db():
+    """Get the shared SQLite connection, opening it on first use.
+    Callers must hold db_lock."""
+    global db_conn
+    if db_conn is None:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+        
+        # WAL lets the dashboard read while the auto-blocker writes
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != 'wal':
+            print(f"⚠️ SQLite journal mode is {mode}, not WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=67108864")
+        conn.execute("PRAGMA cache_size=-8000")
+        db_conn = conn
+    return db_conn
+
 def init_database():
     """Initialize SQLite database"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        
-        # Blocked devices table
-        c.execute('''CREATE TABLE IF NOT EXISTS blocked_devices
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      mac TEXT UNIQUE,
-                      reason TEXT,
-                      blocked_at TIMESTAMP,
-                      unblocked_at TIMESTAMP,
-                      status TEXT DEFAULT 'blocked')''')
-        
-        # Alerts table
-        c.execute('''CREATE TABLE IF NOT EXISTS alerts
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      alert_type TEXT,
-                      mac TEXT,
-                      message TEXT,
-                      severity TEXT,
-                      created_at TIMESTAMP,
-                      email_sent BOOLEAN DEFAULT 0)''')
-        
-        conn.commit()
-        conn.close()
+        with db_lock:
+            c = get_db().cursor()
+            
+            # Blocked devices table
+            c.execute('''CREATE TABLE IF NOT EXISTS blocked_devices
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          mac TEXT UNIQUE,
+                          reason TEXT,
+                          blocked_at TIMESTAMP,
+                          unblocked_at TIMESTAMP,
+                          status TEXT DEFAULT 'blocked')''')
+            
+            # Alerts table
+            c.execute('''CREATE TABLE IF NOT EXISTS alerts
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          alert_type TEXT,
+                          mac TEXT,
+                          message TEXT,
+                          severity TEXT,
+                          created_at TIMESTAMP,
+                          email_sent BOOLEAN DEFAULT 0)''')
+            
+            # Packets table (filled in batches by packet_writer_thread)
+            c.execute('''CREATE TABLE IF NOT EXISTS packets
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          mac TEXT,
+                          rssi INTEGER,
+                          channel INTEGER,
+                          attack_type TEXT,
+                          ssid TEXT,
+                          received_at REAL)''')
+            
+            # Indexes for the status filters
+            c.execute("CREATE INDEX IF NOT EXISTS idx_blocked_status ON blocked_devices(status)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_email_sent ON alerts(email_sent)")
+            
+            # Load blocked MACs into memory once
+            rows = c.execute("SELECT mac FROM blocked_devices WHERE status='blocked'").fetchall()
+        
+        keys = []
+        for (mac,) in rows:
+            key = mac_key(mac)
+            if key is None:
+                print(f"⚠️ Skipping malformed blocked MAC in database: {mac!r}")
+            else:
+                keys.append(key)
+        
+        with blocked_lock:
+            blocked_macs.clear()
+            blocked_macs.update(keys)
+        
         print("✅ Database initialized")
         return True
     except Exception as e:
@@ -117,14 +256,11 @@ def init_database():
 def log_blocked_device(mac, reason):
     """Log blocked device to database"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''INSERT OR REPLACE INTO blocked_devices 
-                     (mac, reason, blocked_at, status) 
-                     VALUES (?, ?, ?, ?)''',
-                 (mac.upper(), reason, datetime.now(), 'blocked'))
-        conn.commit()
-        conn.close()
+        with db_lock:
+            get_db().execute('''INSERT OR REPLACE INTO blocked_devices 
+                                (mac, reason, blocked_at, status) 
+                                VALUES (?, ?, ?, ?)''',
+                             (mac.upper(), reason, datetime.now(), 'blocked'))
         
         # Also log to file
         with open(BLOCK_LOG_FILE, 'a') as f:
@@ -136,23 +272,48 @@ def log_blocked_device(mac, reason):
         print(f"❌ Error logging blocked device: {e}")
         return False
 
+pending_inserts = queue.Queue(maxsize=10000)  # Packet rows waiting to be written
+
+def packet_writer_thread(batch_size=500, max_wait=1.0):
+    """Background thread that writes packets to the database in batches"""
+    print("🗄️ Packet writer thread started")
+    
+    while True:
+        batch = [pending_inserts.get()]
+        deadline = time.time() + max_wait
+        
+        # Collect up to batch_size rows or max_wait seconds worth
+        while len(batch) < batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending_inserts.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        with db_lock:
+            conn = get_db()
+            try:
+                conn.execute("BEGIN")
+                conn.executemany('''INSERT INTO packets
+                                    (mac, rssi, channel, attack_type, ssid, received_at)
+                                    VALUES (?, ?, ?, ?, ?, ?)''', batch)
+                conn.execute("COMMIT")
+            except Exception as e:
+                # Never leave the shared connection inside an open transaction
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                print(f"❌ Error writing {len(batch)} packets: {e}")
+
 def get_blocked_devices():
     """Get all blocked devices"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT mac, reason, blocked_at FROM blocked_devices WHERE status='blocked' ORDER BY blocked_at DESC")
-        devices = c.fetchall()
-        conn.close()
-        
-        blocked_list = []
-        for mac, reason, blocked_at in devices:
-            blocked_list.append({
-                'mac': mac,
-                'reason': reason,
-                'blocked_at': blocked_at
-            })
-        return blocked_list
+        with db_lock:
+            c = get_db().cursor()
+            c.row_factory = sqlite3.Row
+            c.execute("SELECT mac, reason, blocked_at FROM blocked_devices WHERE status='blocked' ORDER BY blocked_at DESC")
+            return [dict(row) for row in c]
     except Exception as e:
         print(f"Error getting blocked devices: {e}")
         return []
@@ -160,18 +321,78 @@ def get_blocked_devices():
 def unblock_mac_in_db(mac):
     """Mark MAC as unblocked in database"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("UPDATE blocked_devices SET status='unblocked', unblocked_at=? WHERE mac=?",
-                 (datetime.now(), mac.upper()))
-        conn.commit()
-        conn.close()
+        with db_lock:
+            get_db().execute("UPDATE blocked_devices SET status='unblocked', unblocked_at=? WHERE mac=?",
+                             (datetime.now(), mac.upper()))
         return True
     except Exception as e:
         print(f"Error unblocking in DB: {e}")
         return False
 
 # ========== EMAIL FUNCTIONS ==========
+class SMTPMailer:
+    """Keeps one authenticated SMTP session open and reuses it for alerts"""
+    
+    def __init__(self, config, max_messages=100, timeout=10):
+        self.config = config
+        self.max_messages = max_messages  # Recycle the session after this many sends
+        self.timeout = timeout
+        self._conn = None
+        self._sent = 0
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        """Open, secure and authenticate a new SMTP session"""
+        conn = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'], timeout=self.timeout)
+        conn.starttls()
+        conn.login(self.config['sender_email'], self.config['sender_password'])
+        self._conn = conn
+        self._sent = 0
+    
+    def _disconnect(self):
+        """Drop the current session, ignoring errors from a dead server"""
+        if self._conn is not None:
+            try:
+                self._conn.quit()
+            except Exception:
+                pass
+            self._conn = None
+    
+    def _ensure_connected(self):
+        """Reuse the open session if it is still healthy, otherwise reconnect"""
+        if self._conn is not None and self._sent >= self.max_messages:
+            self._disconnect()
+        
+        if self._conn is not None:
+            try:
+                if self._conn.noop()[0] != 250:
+                    self._disconnect()
+            except (smtplib.SMTPException, OSError):
+                self._conn = None
+        
+        if self._conn is None:
+            self._connect()
+    
+    def send(self, msg):
+        """Send a message over the shared session"""
+        with self._lock:
+            self._ensure_connected()
+            try:
+                self._conn.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # Server dropped us between NOOP and send - retry once
+                self._connect()
+                self._conn.send_message(msg)
+            self._sent += 1
+    
+    def close(self):
+        """Close the session (registered with atexit)"""
+        with self._lock:
+            self._disconnect()
+
+MAILER = SMTPMailer(EMAIL_CONFIG)
+atexit.register(MAILER.close)
+
 def send_email_alert(subject, body, is_html=False):
     """Send email alert"""
     if not EMAIL_CONFIG['enabled']:
@@ -190,14 +411,8 @@ def send_email_alert(subject, body, is_html=False):
         else:
             msg.attach(MIMEText(body, 'plain'))
         
-        # Connect to SMTP server
-        server = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
-        server.starttls()
-        server.login(EMAIL_CONFIG['sender_email'], EMAIL_CONFIG['sender_password'])
-        
-        # Send email
-        server.send_message(msg)
-        server.quit()
+        # Send over the persistent SMTP session
+        MAILER.send(msg)
         
         print(f"📧 Email sent: {subject}")
         return True
@@ -206,11 +421,8 @@ def send_email_alert(subject, body, is_html=False):
         print(f"❌ Email error: {e}")
         return False
 
-def send_intrusion_alert(mac, attack_type, ssid, rssi):
-    """Send intrusion alert email"""
-    subject = f"🚨 WIDS ALERT: {attack_type} detected on {ssid}"
-    
-    body_html = f"""
+# Intrusion alert email body, filled in with str.format_map
+INTRUSION_ALERT_HTML = """
     <html>
     <body style="font-family: Arial, sans-serif; background: #f5f5f5; padding: 20px;">
         <div style="max-width: 600px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; border-left: 5px solid #ff4444;">
@@ -237,7 +449,7 @@ def send_intrusion_alert(mac, attack_type, ssid, rssi):
                     </tr>
                     <tr>
                         <td style="padding: 8px; border-bottom: 1px solid #eee;"><strong>Time:</strong></td>
-                        <td style="padding: 8px; border-bottom: 1px solid #eee;">{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</td>
+                        <td style="padding: 8px; border-bottom: 1px solid #eee;">{now}</td>
                     </tr>
                 </table>
             </div>
@@ -249,53 +461,214 @@ def send_intrusion_alert(mac, attack_type, ssid, rssi):
             
             <div style="margin-top: 30px; padding-top: 20px; border-top: 1px solid #eee; color: #666; font-size: 12px;">
                 <p>This is an automated alert from your WIDS (Wireless Intrusion Detection System).</p>
-                <p>Check dashboard for more details: http://{get_ip()}:8000</p>
+                <p>Check dashboard for more details: http://{server_ip}:8000</p>
             </div>
         </div>
     </body>
     </html>
     """
+
+def send_intrusion_alert(mac, attack_type, ssid, rssi):
+    """Send intrusion alert email"""
+    subject = f"🚨 WIDS ALERT: {attack_type} detected on {ssid}"
+    
+    body_html = INTRUSION_ALERT_HTML.format_map({
+        'attack_type': attack_type,
+        'mac': mac,
+        'ssid': ssid,
+        'rssi': rssi,
+        'now': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'server_ip': get_ip()
+    })
     
     return send_email_alert(subject, body_html, is_html=True)
 
-# ========== IPTABLES BLOCKING FUNCTIONS (FIXED - NO SUDO) ==========
-def block_with_iptables(mac, reason):
-    """Block MAC address using iptables"""
+# ========== ALERT QUEUE ==========
+alert_queue = queue.Queue(maxsize=1000)  # (mac, attack_type, ssid, rssi) waiting to be emailed
+
+def queue_intrusion_alert(mac, attack_type, ssid, rssi):
+    """Queue an intrusion alert without waiting on SMTP"""
     try:
-        mac = mac.upper()
-        
-        # Check if already blocked - NO SUDO NEEDED
-        check = subprocess.run(
-            f"iptables -L INPUT -n 2>/dev/null | grep -i {mac}",
-            shell=True, capture_output=True, text=True
+        alert_queue.put_nowait((mac, attack_type, ssid, rssi))
+        return True
+    except queue.Full:
+        print(f"⚠️ Alert queue full, dropping alert for {mac}")
+        return False
+
+def alert_worker():
+    """Background thread that sends queued intrusion alerts"""
+    print("📧 Alert worker thread started")
+    
+    while True:
+        alert = alert_queue.get()
+        try:
+            send_intrusion_alert(*alert)
+        except Exception as e:
+            print(f"❌ Error in alert worker: {e}")
+        finally:
+            alert_queue.task_done()
+
+def drain_alert_queue(max_seconds=10, max_alerts=5):
+    """Send a few alerts still queued at shutdown, dropping the rest"""
+    deadline = time.time() + max_seconds
+    sent = 0
+    while sent < max_alerts and time.time() < deadline:
+        try:
+            alert = alert_queue.get_nowait()
+        except queue.Empty:
+            return
+        send_intrusion_alert(*alert)
+        sent += 1
+    
+    dropped = alert_queue.qsize()
+    if dropped:
+        print(f"⚠️ Dropped {dropped} queued alerts at shutdown")
+
+atexit.register(drain_alert_queue)
+
+# ========== IPSET BLOCKING FUNCTIONS ==========
+ipset_ops = queue.Queue()  # "add"/"del" lines waiting for the next ipset restore
+
+def setup_ipset():
+    """Create the block set and reference it once from raw PREROUTING"""
+    try:
+        subprocess.run(
+            ["ipset", "create", IPSET_NAME, "hash:mac", "timeout", "0", "-exist"],
+            capture_output=True, check=True
         )
         
-        if check.returncode != 0:  # Not blocked yet
-            print(f"[{datetime.now()}] 🚨 BLOCKING {mac} - {reason}")
-            
-            # Block incoming traffic - NO SUDO
-            result1 = subprocess.run(
-                f"iptables -A INPUT -m mac --mac-source {mac} -j DROP",
-                shell=True, capture_output=True, text=True
+        # Restore MACs blocked in a previous run
+        if os.path.exists(IPSET_SAVE_FILE):
+            subprocess.run(
+                ["ipset", "restore", "-exist", "-file", IPSET_SAVE_FILE],
+                capture_output=True
             )
+        
+        # Re-add everything the database still has blocked, in case the
+        # saved set is missing or stale; blocked_macs is authoritative from here on
+        with blocked_lock:
+            for key in blocked_macs:
+                ipset_ops.put(f"add {IPSET_NAME} {mac_str(key)}")
+        
+        # One DROP rule in raw/PREROUTING matches every MAC in the set
+        # before conntrack sees the packet
+        match = ["-m", "set", "--match-set", IPSET_NAME, "src", "-j", "DROP"]
+        if subprocess.run(IPTABLES + ["-t", "raw", "-C", "PREROUTING"] + match,
+                          capture_output=True).returncode != 0:
+            subprocess.run(IPTABLES + ["-t", "raw", "-I", "PREROUTING"] + match,
+                           capture_output=True, check=True)
+        
+        # Remove the filter-table rules older versions installed
+        for chain in ("INPUT", "FORWARD"):
+            subprocess.run(IPTABLES + ["-D", chain] + match, capture_output=True)
+        migrate_legacy_rules()
+        
+        print(f"✅ ipset {IPSET_NAME} ready")
+        return True
+    except Exception as e:
+        print(f"❌ Error setting up ipset: {e}")
+        return False
+
+def migrate_legacy_rules():
+    """Move MACs blocked by old per-MAC iptables rules into the block set"""
+    for chain in ("INPUT", "FORWARD"):
+        listing = subprocess.run(IPTABLES + ["-S", chain], capture_output=True)
+        if listing.returncode != 0:
+            continue
+        for chain_name, mac in LEGACY_RULE_RE.findall(listing.stdout.decode('utf-8', 'replace')):
+            key = mac_key(mac)
+            if key is None:
+                continue
             
-            # Block forwarded traffic - NO SUDO
-            result2 = subprocess.run(
-                f"iptables -A FORWARD -m mac --mac-source {mac} -j DROP",
-                shell=True, capture_output=True, text=True
+            # Add to the set first so the MAC stays dropped, then remove the old rule
+            # so unblocking through the set actually lets it back in
+            added = subprocess.run(["ipset", "add", IPSET_NAME, mac_str(key), "-exist"],
+                                   capture_output=True)
+            if added.returncode != 0:
+                print(f"⚠️ Could not migrate legacy block for {mac}, keeping its rule")
+                continue
+            with blocked_lock:
+                known = key in blocked_macs
+                blocked_macs.add(key)
+            if not known:
+                log_blocked_device(mac_str(key), "Migrated from legacy iptables rule")
+            subprocess.run(IPTABLES + ["-D", chain_name, "-m", "mac", "--mac-source", mac, "-j", "DROP"],
+                           capture_output=True)
+            print(f"🔁 Migrated legacy iptables block for {mac_str(key)} to ipset")
+
+def save_ipset():
+    """Persist the block set so it survives a reboot"""
+    try:
+        with open(IPSET_SAVE_FILE, 'w') as f:
+            subprocess.run(["ipset", "save", IPSET_NAME], stdout=f, timeout=5)
+    except Exception:
+        pass  # Saving might fail, but blocking still works
+
+atexit.register(save_ipset)
+
+ipset_save_pending = threading.Event()  # Set when the block set has changed
+
+def ipset_saver_thread():
+    """Background thread that coalesces block-set saves"""
+    while True:
+        ipset_save_pending.wait()
+        time.sleep(2)  # Let a burst of blocks settle before saving once
+        ipset_save_pending.clear()
+        save_ipset()
+
+def ipset_writer_thread(max_wait=0.1):
+    """Background thread that applies queued add/del ops in one ipset restore"""
+    # Set up here rather than before serving, so a busy xtables lock at boot
+    # delays only blocking; ops queued meanwhile are applied once it is done
+    setup_ipset()
+    
+    while True:
+        lines = [ipset_ops.get()]
+        deadline = time.time() + max_wait
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                lines.append(ipset_ops.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        try:
+            result = subprocess.run(
+                ["ipset", "restore", "-exist"],
+                input=("\n".join(lines) + "\n").encode(), capture_output=True, timeout=10
             )
+            if result.returncode != 0:
+                # Output is only decoded when there is an error to report
+                print(f"❌ ipset restore failed: {result.stderr.decode(errors='replace').strip()}")
+            ipset_save_pending.set()
+        except Exception as e:
+            print(f"❌ Error applying {len(lines)} ipset ops: {e}")
+
+def block_with_iptables(mac, reason):
+    """Block MAC address by adding it to the ipset"""
+    try:
+        mac = mac.upper()
+        if not MAC_RE.fullmatch(mac):
+            print(f"❌ Refusing to block invalid MAC: {mac}")
+            return False
+        
+        # Check if already blocked (blocked_macs mirrors the ipset)
+        key = mac_key(mac)
+        with blocked_lock:
+            already_blocked = key in blocked_macs
+            blocked_macs.add(key)
+        
+        if not already_blocked:
+            print(f"[{datetime.now()}] 🚨 BLOCKING {mac} - {reason}")
             
-            # Try to save iptables rules - NO SUDO
-            try:
-                subprocess.run(
-                    "iptables-save > /etc/iptables/rules.v4 2>/dev/null",
-                    shell=True, timeout=5
-                )
-            except:
-                pass  # Saving might fail, but blocking still works
+            ipset_ops.put(f"add {IPSET_NAME} {mac}")
             
             # Log to database
             log_blocked_device(mac, reason)
+            response_cache.clear()
+            publish_event('blocked')
             
             print(f"✅ Successfully blocked {mac}")
             return True
@@ -311,20 +684,21 @@ def unblock_mac(mac):
     """Unblock MAC address"""
     try:
         mac = mac.upper()
+        if not MAC_RE.fullmatch(mac):
+            print(f"❌ Refusing to unblock invalid MAC: {mac}")
+            return False
+        
         print(f"[{datetime.now()}] 🔓 UNBLOCKING {mac}")
         
-        # Remove iptables rules - NO SUDO
-        subprocess.run(
-            f"iptables -D INPUT -m mac --mac-source {mac} -j DROP 2>/dev/null",
-            shell=True
-        )
-        subprocess.run(
-            f"iptables -D FORWARD -m mac --mac-source {mac} -j DROP 2>/dev/null",
-            shell=True
-        )
+        # Remove from the block set
+        ipset_ops.put(f"del {IPSET_NAME} {mac}")
         
         # Update database
         unblock_mac_in_db(mac)
+        with blocked_lock:
+            blocked_macs.discard(mac_key(mac))
+        response_cache.clear()
+        publish_event('blocked')
         
         print(f"✅ Successfully unblocked {mac}")
         return True
@@ -333,168 +707,225 @@ def unblock_mac(mac):
         return False
 
 # ========== INTRUSION DETECTION LOGIC ==========
+# Attack type -> reason template
+_ATTACK_REASONS = {
+    "auth_attempt": "Authentication attempt on {ssid}",
+    "association": "Association request on {ssid}",
+    "deauth_attack": "Deauthentication attack detected",
+    "probe_request": "Probing for {ssid}",
+}
+
+# Attack types that only count when aimed at YOUR_SSID
+_SSID_REQUIRED = {"auth_attempt", "association", "probe_request"}
+
 def check_intrusion(packet):
     """Check if packet indicates intrusion"""
-    mac = packet.get('mac', '').upper()
-    ssid = packet.get('ssid', '')
     attack_type = packet.get('attack_type', '')
-    rssi = packet.get('rssi', -99)
     
-    # Skip if no MAC
-    if not mac or mac == '00:00:00:00:00:00':
+    # Skip packets that are not an attack we care about
+    template = _ATTACK_REASONS.get(attack_type)
+    if template is None:
         return None
     
-    # Skip if authorized
-    if mac in authorized_macs:
+    ssid = packet.get('ssid', '')
+    if attack_type in _SSID_REQUIRED and ssid != YOUR_SSID:
         return None
     
-    intrusion_reasons = []
+    key = packet['key'] if 'key' in packet else mac_key(packet.get('mac', ''))
     
-    # Check various attack types
-    if attack_type == "auth_attempt" and ssid == YOUR_SSID:
-        intrusion_reasons.append(f"Authentication attempt on {YOUR_SSID}")
+    # Skip if no MAC
+    if not key or key == ZERO_MAC:
+        return None
     
-    if attack_type == "association" and ssid == YOUR_SSID:
-        intrusion_reasons.append(f"Association request on {YOUR_SSID}")
+    # Skip if authorized
+    if key in authorized_macs:
+        return None
     
-    if attack_type == "deauth_attack":
-        intrusion_reasons.append("Deauthentication attack detected")
+    mac = mac_str(key)
+    rssi = packet.get('rssi', -99)
+    reason = template.format(ssid=ssid)
+    now = time.time()
     
-    if attack_type == "probe_request" and ssid == YOUR_SSID:
-        intrusion_reasons.append(f"Probing for {YOUR_SSID}")
+    # Log threat
+    threat_log.append((now, mac, attack_type, reason, rssi))
+    publish_event('threats')
     
-    if intrusion_reasons:
-        reason = " | ".join(intrusion_reasons)
-        
-        # Log threat
-        threat_log.append({
-            'time': datetime.now(),
-            'mac': mac,
-            'type': attack_type,
-            'reason': reason,
-            'rssi': rssi
-        })
-        
-        # Keep only last 100 threats
-        if len(threat_log) > 100:
-            threat_log.pop(0)
-        
-        return {
-            'mac': mac,
-            'attack_type': attack_type,
-            'ssid': ssid,
-            'rssi': rssi,
-            'reason': reason,
-            'timestamp': datetime.now().isoformat()
-        }
-    
-    return None
+    return {
+        'mac': mac,
+        'key': key,
+        'attack_type': attack_type,
+        'ssid': ssid,
+        'rssi': rssi,
+        'reason': reason,
+        'timestamp': now
+    }
 
 # ========== AUTO-BLOCKING THREAD ==========
+intrusion_queue = queue.Queue(maxsize=5000)  # Packets waiting for intrusion checks
+
+# Attack types that are blocked automatically
+AUTO_BLOCK_ATTACKS = {'auth_attempt', 'association', 'deauth_attack'}
+
 def auto_blocking_thread():
     """Background thread for auto-blocking"""
     print("🛡️ Auto-blocking thread started")
     
     while True:
         try:
-            # Process recent packets for intrusions
-            processed_macs = set()
-            for packet in packets[-100:]:  # Check last 100 packets
-                intrusion = check_intrusion(packet)
-                
-                if intrusion:
-                    mac = intrusion['mac']
-                    
-                    # Skip if already processed in this cycle
-                    if mac in processed_macs:
-                        continue
-                    
-                    processed_macs.add(mac)
-                    reason = intrusion['reason']
-                    
-                    # Auto-block for critical attacks
-                    if intrusion['attack_type'] in ['auth_attempt', 'association', 'deauth_attack']:
-                        if block_with_iptables(mac, reason):
-                            # Send email alert
-                            send_intrusion_alert(
-                                mac, 
-                                intrusion['attack_type'],
-                                intrusion['ssid'],
-                                intrusion['rssi']
-                            )
+            # Each packet is checked exactly once, as soon as it arrives
+            packet = intrusion_queue.get()
+            intrusion = check_intrusion(packet)
             
-            time.sleep(5)  # Check every 5 seconds
+            if intrusion:
+                mac = intrusion['mac']
+                
+                # Auto-block for critical attacks
+                if intrusion['attack_type'] in AUTO_BLOCK_ATTACKS and not is_mac_blocked(intrusion['key']):
+                    if block_with_iptables(mac, intrusion['reason']):
+                        # Queue email alert for the alert worker
+                        queue_intrusion_alert(
+                            mac, 
+                            intrusion['attack_type'],
+                            intrusion['ssid'],
+                            intrusion['rssi']
+                        )
             
         except KeyboardInterrupt:
             print("\n🛑 Stopping auto-blocking thread")
             break
         except Exception as e:
             print(f"❌ Error in auto-blocking thread: {e}")
-            time.sleep(10)
 
 # ========== FLASK ROUTES ==========
+def load_dashboard_template():
+    """Read and compile dashboard.html once"""
+    if not os.path.exists(DASHBOARD_FILE):
+        return None
+    with open(DASHBOARD_FILE, 'r') as f:
+        return app.jinja_env.from_string(f.read())
+
+dashboard_template = load_dashboard_template()
+dashboard_page = None  # (html, gzipped html, etag), cached once get_ip() has succeeded
+
+def render_dashboard():
+    """Render dashboard.html and pre-compress it"""
+    html = dashboard_template.render(server_ip=get_ip(),
+                                     server_port=8000,
+                                     your_ssid=YOUR_SSID).encode('utf-8')
+    return html, gzip.compress(html, 9), hashlib.sha1(html).hexdigest()
+
 @app.route('/')
 def dashboard():
     """Main dashboard"""
+    global dashboard_page
     try:
         # Check if dashboard.html exists
-        if not os.path.exists(DASHBOARD_FILE):
+        if dashboard_template is None:
             return "Error: dashboard.html not found. Please create it.", 404
-            
-        with open(DASHBOARD_FILE, 'r') as f:
-            html = f.read()
-            
-        return render_template_string(html, 
-                                     server_ip=get_ip(),
-                                     server_port=8000,
-                                     your_ssid=YOUR_SSID)
+        
+        page = dashboard_page
+        if page is None:
+            page = render_dashboard()
+            if server_ip is not None:
+                dashboard_page = page
+        html, html_gz, etag = page
+        
+        # Send the pre-compressed copy to clients that accept gzip
+        if 'gzip' in request.accept_encodings:
+            response = app.response_class(html_gz, mimetype='text/html')
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(etag + '-gz')
+        else:
+            response = app.response_class(html, mimetype='text/html')
+            response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response.make_conditional(request)
     except Exception as e:
         return f"Error loading dashboard: {e}", 500
 
 @app.route('/api/packet', methods=['POST'])
 def receive_packet():
     """Receive packet from ESP32"""
+    global packet_total
     try:
         data = request.json
         if not data:
             return jsonify({'error': 'No data'}), 400
         
-        # Add metadata
-        data['received_at'] = datetime.now().isoformat()
+        # Add metadata (epoch seconds, formatted only when serialized)
+        now = time.time()
+        data['received_at'] = now
         data['client_ip'] = request.remote_addr
         
-        # Store packet
-        packets.append(data)
-        if len(packets) > 1000:
-            packets.pop(0)
+        # Coerce the stored fields to scalars so they bind cleanly in SQLite
+        has_rssi = 'rssi' in data
+        try:
+            data['rssi'] = int(data.get('rssi', -99))
+            data['channel'] = int(data.get('channel', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'rssi and channel must be numbers'}), 400
+        data['attack_type'] = str(data.get('attack_type') or '')
+        data['ssid'] = str(data.get('ssid') or '')
+        
+        # Canonicalize the MAC once; everything downstream uses the key
+        mac = str(data.get('mac', ''))
+        key = mac_key(mac)
+        if key:
+            mac = data['mac'] = mac_str(key)
+        data['key'] = key
+        
+        # One compact row serves the recent-packet log and the database writer
+        row = (
+            mac,
+            data['rssi'],
+            data['channel'],
+            data['attack_type'],
+            data['ssid'],
+            now
+        )
+        
+        # Store packet and hand it to the auto-blocker
+        packets.append(row)
+        with packet_total_lock:
+            packet_total += 1
+        # Only packets that could be an intrusion go to the auto-blocker
+        if data.get('attack_type') in _ATTACK_REASONS and key not in authorized_macs:
+            try:
+                intrusion_queue.put_nowait(data)
+            except queue.Full:
+                log.warning("⚠️ Intrusion queue full, packet not checked")
+        try:
+            pending_inserts.put_nowait(row)
+        except queue.Full:
+            log.warning("⚠️ Packet write queue full, packet not persisted")
         
         # Update device info
-        mac = data.get('mac', '').upper()
-        if mac and mac != '00:00:00:00:00:00':
-            if mac not in devices:
-                devices[mac] = {
-                    'mac': mac,
-                    'first_seen': datetime.now(),
-                    'last_seen': datetime.now(),
-                    'packet_count': 1,
-                    'rssi': data.get('rssi', -99),
-                    'channel': data.get('channel', 0),
-                    'attack_types': set(),
-                    'authorized': mac in authorized_macs
-                }
-            else:
-                devices[mac]['last_seen'] = datetime.now()
-                devices[mac]['packet_count'] += 1
-                devices[mac]['rssi'] = data.get('rssi', devices[mac]['rssi'])
-            
-            if 'attack_type' in data and data['attack_type']:
-                devices[mac]['attack_types'].add(data['attack_type'])
+        if key and key != ZERO_MAC:
+            with device_lock(key):
+                if key not in device_last_seen:
+                    device_first_seen[key] = now
+                    device_packet_count[key] = 1
+                    device_rssi[key] = data['rssi']
+                    device_channel[key] = data['channel']
+                    device_attack_types[key] = set()
+                else:
+                    device_packet_count[key] += 1
+                    if has_rssi:
+                        device_rssi[key] = data['rssi']
+                
+                if data['attack_type']:
+                    device_attack_types[key].add(data['attack_type'])
+                
+                # Written last so readers never see a half-created device
+                device_last_seen[key] = now
         
-        print(f"📦 Packet: {mac} | {data.get('attack_type', 'unknown')}")
+        publish_event('packets')
+        
+        log.debug("📦 Packet: %s | %s", mac, data['attack_type'] or 'unknown')
         
         return jsonify({
             'status': 'received',
-            'authorized': mac in authorized_macs,
+            'authorized': key in authorized_macs,
             'message': f'Packet from {mac} received'
         })
         
@@ -502,32 +933,95 @@ def receive_packet():
         print(f"❌ Error processing packet: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """Server-Sent Events naming the data that changed (see PACKET_EVENT_INTERVAL)"""
+    q = queue.Queue(maxsize=100)
+    with subscribers_lock:
+        if len(event_subscribers) >= MAX_EVENT_SUBSCRIBERS:
+            return jsonify({'error': 'Too many live dashboards, poll instead'}), 503
+        event_subscribers.add(q)
+    
+    def stream():
+        yield "retry: 5000\n\n"
+        kinds = set()       # Changes not sent yet
+        packets_due = 0.0   # Earliest time another 'packets' event may go out
+        while True:
+            # Only throttled packet news waiting: sleep until it is due
+            wait = packets_due - time.time() if kinds == {'packets'} else 15
+            try:
+                kinds.add(q.get(timeout=max(wait, 0)))
+            except queue.Empty:
+                if not kinds:
+                    yield ": keepalive\n\n"
+                    continue
+            else:
+                # Fold a burst of changes into one event
+                time.sleep(1)
+                while True:
+                    try:
+                        kinds.add(q.get_nowait())
+                    except queue.Empty:
+                        break
+            
+            now = time.time()
+            if kinds == {'packets'} and now < packets_due:
+                continue
+            if 'packets' in kinds:
+                packets_due = now + PACKET_EVENT_INTERVAL
+            yield f"data: {json.dumps(sorted(kinds))}\n\n"
+            kinds = set()
+    
+    def unsubscribe():
+        with subscribers_lock:
+            event_subscribers.discard(q)
+    
+    response = app.response_class(stream(), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache'})
+    response.call_on_close(unsubscribe)
+    return response
+
+def compute_devices(recent=None):
+    """Build the /api/devices payload, newest first"""
+    # Only include recent devices (last hour)
+    if recent is None:
+        recent = recent_devices()
+    
+    # Sort by last seen (newest first)
+    recent = sorted(recent, key=lambda item: item[1], reverse=True)
+    
+    device_list = []
+    for key, last_seen in recent:
+        device_list.append({
+            'mac': mac_str(key),
+            'first_seen': iso_time(device_first_seen[key]),
+            'last_seen': iso_time(last_seen),
+            'packet_count': device_packet_count[key],
+            'rssi': device_rssi[key],
+            'channel': device_channel[key],
+            'attack_types': list(device_attack_types[key]),
+            'authorized': key in authorized_macs,
+            'blocked': is_mac_blocked(key)
+        })
+    return device_list
+
 @app.route('/api/devices', methods=['GET'])
 def get_devices():
     """Get all detected devices"""
     try:
-        device_list = []
-        now = datetime.now()
-        
-        for mac, info in devices.items():
-            # Only include recent devices (last hour)
-            if (now - info['last_seen']).total_seconds() < 3600:
-                device_list.append({
-                    'mac': mac,
-                    'first_seen': info['first_seen'].isoformat(),
-                    'last_seen': info['last_seen'].isoformat(),
-                    'packet_count': info['packet_count'],
-                    'rssi': info['rssi'],
-                    'channel': info['channel'],
-                    'attack_types': list(info.get('attack_types', [])),
-                    'authorized': info['authorized'],
-                    'blocked': is_mac_blocked(mac)
-                })
-        
-        # Sort by last seen (newest first)
-        device_list.sort(key=lambda x: x['last_seen'], reverse=True)
-        
-        return jsonify(device_list)
+        return jsonify(compute_devices())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """Stats and devices for the default dashboard view from one pass over the devices"""
+    try:
+        recent = recent_devices()
+        return jsonify({
+            'stats': compute_stats(recent),
+            'devices': compute_devices(recent)
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -536,14 +1030,14 @@ def get_packets():
     """Get recent packets"""
     try:
         recent_packets = []
-        for p in packets[-50:]:
+        for mac, rssi, channel, attack_type, ssid, received_at in list(packets)[-50:]:
             recent_packets.append({
-                'mac': p.get('mac', 'unknown'),
-                'rssi': p.get('rssi', -99),
-                'channel': p.get('channel', 0),
-                'attack_type': p.get('attack_type', 'unknown'),
-                'ssid': p.get('ssid', ''),
-                'timestamp': p.get('received_at', '')
+                'mac': mac or 'unknown',
+                'rssi': rssi,
+                'channel': channel,
+                'attack_type': attack_type or 'unknown',
+                'ssid': ssid,
+                'timestamp': iso_time(received_at)
             })
         
         return jsonify(recent_packets[::-1])  # Reverse to show newest first
@@ -555,7 +1049,7 @@ def get_authorized():
     """Get list of authorized MACs"""
     try:
         auth_list = []
-        for mac in sorted(authorized_macs):
+        for mac in sorted(mac_str(key) for key in authorized_macs):
             auth_list.append({
                 'mac': mac,
                 'added_at': 'From config'
@@ -571,14 +1065,12 @@ def authorize_mac(mac):
         mac_upper = mac.upper()
         
         # Validate MAC format
-        if not re.match(r'^([0-9A-F]{2}:){5}[0-9A-F]{2}$', mac_upper):
+        if not MAC_RE.fullmatch(mac_upper):
             return jsonify({'error': 'Invalid MAC format. Use AA:BB:CC:DD:EE:FF'}), 400
         
-        authorized_macs.add(mac_upper)
-        
-        # Update device if it exists
-        if mac_upper in devices:
-            devices[mac_upper]['authorized'] = True
+        authorized_macs.add(mac_key(mac_upper))
+        response_cache.clear()
+        publish_event('authorized')
         
         # Save to file
         save_authorized_macs()
@@ -593,11 +1085,9 @@ def unauthorize_mac(mac):
     """Remove MAC from authorized list"""
     try:
         mac_upper = mac.upper()
-        authorized_macs.discard(mac_upper)
-        
-        # Update device if it exists
-        if mac_upper in devices:
-            devices[mac_upper]['authorized'] = False
+        authorized_macs.discard(mac_key(mac_upper))
+        response_cache.clear()
+        publish_event('authorized')
         
         # Save to file
         save_authorized_macs()
@@ -611,6 +1101,10 @@ def unauthorize_mac(mac):
 def block_device(mac):
     """Manually block a device"""
     try:
+        mac = mac.upper()
+        if not MAC_RE.fullmatch(mac):
+            return jsonify({'error': 'Invalid MAC format. Use AA:BB:CC:DD:EE:FF'}), 400
+        
         reason = request.json.get('reason', 'manual_block') if request.json else 'manual_block'
         
         if block_with_iptables(mac, reason):
@@ -624,6 +1118,10 @@ def block_device(mac):
 def unblock_device(mac):
     """Unblock a device"""
     try:
+        mac = mac.upper()
+        if not MAC_RE.fullmatch(mac):
+            return jsonify({'error': 'Invalid MAC format. Use AA:BB:CC:DD:EE:FF'}), 400
+        
         if unblock_mac(mac):
             return jsonify({'status': 'unblocked', 'mac': mac, 'message': f'Unblocked {mac}'})
         else:
@@ -635,7 +1133,7 @@ def unblock_device(mac):
 def list_blocked():
     """Get list of blocked devices"""
     try:
-        return jsonify(get_blocked_devices())
+        return jsonify(cached_payload('blocked', get_blocked_devices))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -644,46 +1142,50 @@ def get_threats():
     """Get recent threats"""
     try:
         recent_threats = []
-        for threat in threat_log[-50:]:
+        for ts, mac, attack_type, reason, rssi in list(threat_log)[-50:]:
             recent_threats.append({
-                'time': threat['time'].isoformat(),
-                'mac': threat['mac'],
-                'type': threat['type'],
-                'reason': threat['reason'],
-                'rssi': threat['rssi']
+                'time': iso_time(ts),
+                'mac': mac,
+                'type': attack_type,
+                'reason': reason,
+                'rssi': rssi
             })
         return jsonify(recent_threats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def recent_devices():
+    """(MAC key, last seen) for devices seen in the last hour"""
+    now = time.time()
+    return [(key, ts) for key, ts in list(device_last_seen.items()) if now - ts < 3600]
+
+def compute_stats(recent=None):
+    """Build the /api/stats payload"""
+    # Count devices seen in the last hour
+    if recent is None:
+        recent = recent_devices()
+    total = len(recent)
+    authorized = len(authorized_macs.intersection(key for key, _ in recent))
+    
+    blocked = len(blocked_macs)
+    
+    return {
+        'total_devices': total,
+        'authorized_devices': authorized,
+        'unauthorized_devices': total - authorized,
+        'blocked_devices': blocked,
+        'total_packets': packet_total,
+        'recent_threats': min(len(threat_log), 24),
+        'server_time': datetime.now().isoformat(),
+        'server_ip': get_ip(),
+        'protected_ssid': YOUR_SSID
+    }
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get system statistics"""
     try:
-        # Count devices
-        total = 0
-        authorized = 0
-        now = datetime.now()
-        
-        for info in devices.values():
-            if (now - info['last_seen']).total_seconds() < 3600:
-                total += 1
-                if info['authorized']:
-                    authorized += 1
-        
-        blocked = len(get_blocked_devices())
-        
-        return jsonify({
-            'total_devices': total,
-            'authorized_devices': authorized,
-            'unauthorized_devices': total - authorized,
-            'blocked_devices': blocked,
-            'total_packets': len(packets),
-            'recent_threats': len(threat_log[-24:]),
-            'server_time': datetime.now().isoformat(),
-            'server_ip': get_ip(),
-            'protected_ssid': YOUR_SSID
-        })
+        return jsonify(cached_payload('stats', compute_stats))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -709,28 +1211,84 @@ def get_status():
         'time': datetime.now().isoformat(),
         'email_enabled': EMAIL_CONFIG['enabled'],
         'authorized_count': len(authorized_macs),
-        'device_count': len(devices),
-        'packet_count': len(packets),
-        'blocked_count': len(get_blocked_devices())
+        'device_count': len(device_last_seen),
+        'packet_count': packet_total,
+        'blocked_count': len(blocked_macs)
     })
 
+# ========== BACKGROUND WORKERS ==========
+# Each worker owns one kind of blocking I/O and is fed by a queue or event,
+# so request threads only ever append to in-memory structures.
+BACKGROUND_WORKERS = [
+    ('auto-blocker', auto_blocking_thread),     # intrusion_queue -> ipset
+    ('alert-worker', alert_worker),             # alert_queue -> SMTP
+    ('packet-writer', packet_writer_thread),    # pending_inserts -> SQLite
+    ('ipset-writer', ipset_writer_thread),      # setup_ipset, then ipset_ops -> ipset restore
+    ('ipset-saver', ipset_saver_thread),        # ipset_save_pending -> disk
+]
+
+def start_background_threads():
+    """Start one daemon thread per background worker"""
+    threads = []
+    for name, target in BACKGROUND_WORKERS:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
 # ========== UTILITY FUNCTIONS ==========
-def is_mac_blocked(mac):
-    """Check if MAC is blocked"""
-    blocked = get_blocked_devices()
-    for device in blocked:
-        if device['mac'].upper() == mac.upper():
-            return True
-    return False
+RESPONSE_TTL = 1.0  # Seconds a polled payload is reused (see cached_payload)
+response_cache = {}  # Name -> (computed_at, payload); cleared on block/authorize changes
+
+def cached_payload(name, compute):
+    """Return compute(), reusing the last result for up to RESPONSE_TTL seconds"""
+    now = time.time()
+    hit = response_cache.get(name)
+    if hit is not None and now - hit[0] < RESPONSE_TTL:
+        return hit[1]
+    payload = compute()
+    response_cache[name] = (now, payload)
+    return payload
+
+ZERO_MAC = bytes(6)
+
+def mac_key(mac):
+    """Canonical 6-byte key for a MAC string, or None if it is not a MAC"""
+    try:
+        key = bytes.fromhex(mac.replace(':', ''))
+    except (ValueError, AttributeError):
+        return None
+    return key if len(key) == 6 else None
+
+def mac_str(key):
+    """Format a MAC key as AA:BB:CC:DD:EE:FF"""
+    return key.hex(':').upper()
+
+def device_lock(key):
+    """Lock guarding one MAC's device entries; different MACs rarely share one"""
+    return device_locks[key[-1] & 15]
+
+def is_mac_blocked(key):
+    """Check if MAC key is blocked"""
+    return key in blocked_macs
+
+def iso_time(ts):
+    """Format an epoch timestamp as an ISO string for JSON responses"""
+    return datetime.fromtimestamp(ts).isoformat()
+
+server_ip = None  # Cached by get_ip() once a lookup succeeds
 
 def get_ip():
     """Get server IP address"""
+    global server_ip
+    if server_ip is not None:
+        return server_ip
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(('8.8.8.8', 80))
-        ip = s.getsockname()[0]
+        server_ip = s.getsockname()[0]
         s.close()
-        return ip
+        return server_ip
     except:
         return '127.0.0.1'
 
@@ -750,14 +1308,13 @@ if __name__ == '__main__':
     load_authorized_macs()
     init_database()
     
-    # Start auto-blocking thread
-    blocker_thread = threading.Thread(target=auto_blocking_thread, daemon=True)
-    blocker_thread.start()
+    # Start background workers
+    start_background_threads()
     
     print(f"\n📡 Protecting SSID: {YOUR_SSID}")
     print(f"📧 Email alerts: {'ENABLED' if EMAIL_CONFIG['enabled'] else 'DISABLED'}")
     print(f"🏠 Dashboard URL: http://{get_ip()}:8000")
-    print(f"🔧 IPTables auto-blocking: ACTIVE")
+    print(f"🔧 IPTables auto-blocking: ACTIVE (ipset {IPSET_NAME})")
     print(f"📁 Database: {DB_FILE}")
     print(f"📝 Log file: {BLOCK_LOG_FILE}")
     
@@ -768,5 +1325,11 @@ if __name__ == '__main__':
     print("\n✅ Server starting... Press Ctrl+C to stop")
     print("="*70 + "\n")
     
-    # Run Flask
-    app.run(host='0.0.0.0', port=8000, debug=False, threaded=True)
+    # Run Flask under waitress if available, else the Werkzeug dev server
+    try:
+        from waitress import serve
+        print("🍽️ Serving with waitress (8 threads)")
+        serve(app, host='0.0.0.0', port=8000, threads=8)
+    except ImportError:
+        print("⚠️ waitress not installed, using Flask dev server (pip3 install waitress)")
+        app.run(host='0.0.0.0', port=8000, debug=False, threaded=True)
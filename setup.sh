@@ -11,11 +11,11 @@ sudo apt update
 
 # Install dependencies
 echo "📦 Installing Python and dependencies..."
-sudo apt install -y python3 python3-pip python3-venv sqlite3 iptables iptables-persistent
+sudo apt install -y python3 python3-pip python3-venv sqlite3 iptables iptables-persistent ipset
 
 # Install Python packages
 echo "📦 Installing Python packages..."
-pip3 install flask pyopenssl cryptography requests
+pip3 install flask waitress orjson pyopenssl cryptography requests
 
 # Create directory structure
 cd ~/wids-system
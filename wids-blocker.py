@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import json
+import re
 import subprocess
 import time
 from datetime import datetime
@@ -13,26 +14,41 @@ AUTHORIZED_MACS = {
 # Your router's SSID
 YOUR_ROUTER_SSID = "YourHomeWiFi"
 
+# MACs this process has already blocked
+blocked_macs = set()
+
+# Wait up to 5s for the xtables lock instead of failing when it is busy
+IPTABLES = ["sudo", "iptables", "-w", "5"]
+
+# Blocked MACs live in one ipset matched by a single DROP rule
+IPSET_NAME = "wids_block"
+
+# MAC addresses accepted before they reach ipset, after upper-casing (same as server.py)
+MAC_RE = re.compile(r'[0-9A-F]{2}(:[0-9A-F]{2}){5}')
+
+def setup_block_set():
+    """Create the block set and the one rule that drops its members"""
+    # Same set options as server.py so either script can create it first
+    subprocess.run(["sudo", "ipset", "create", IPSET_NAME, "hash:mac", "timeout", "0", "-exist"])
+    rule = ["PREROUTING", "-m", "set", "--match-set", IPSET_NAME, "src", "-j", "DROP"]
+    if subprocess.run(IPTABLES + ["-t", "raw", "-C"] + rule, capture_output=True).returncode != 0:
+        subprocess.run(IPTABLES + ["-t", "raw", "-I"] + rule)
+
 def block_mac(mac_address, reason):
-    """Block MAC address using iptables"""
-    # Check if already blocked
-    check = subprocess.run(
-        f"sudo iptables -L INPUT -n | grep {mac_address}",
-        shell=True,
-        capture_output=True
-    )
+    """Block MAC address by adding it to the ipset"""
+    # Reject anything that is not a MAC before it reaches ipset
+    mac_address = str(mac_address).upper()
+    if not MAC_RE.fullmatch(mac_address):
+        print(f"[{datetime.now()}] Invalid MAC {mac_address!r}, not blocking")
+        return
     
-    if check.returncode != 0:  # Not blocked yet
+    # Check if already blocked
+    if mac_address not in blocked_macs:
         print(f"[{datetime.now()}] BLOCKING {mac_address} - {reason}")
+        blocked_macs.add(mac_address)
         
-        # Block with iptables
-        commands = [
-            f"sudo iptables -A INPUT -m mac --mac-source {mac_address} -j DROP",
-            f"sudo iptables -A FORWARD -m mac --mac-source {mac_address} -j DROP"
-        ]
-        
-        for cmd in commands:
-            subprocess.run(cmd, shell=True)
+        # Block with ipset (-exist ignores MACs left over from an earlier run)
+        subprocess.run(["sudo", "ipset", "add", IPSET_NAME, mac_address, "-exist"])
         
         # Log to file
         with open("/var/log/wids_block.log", "a") as f:
@@ -68,5 +84,6 @@ def process_packet(packet_data):
 if __name__ == "__main__":
     # This would connect to your WIDS server
     # For now, simulate reading packets
+    setup_block_set()
     print("WIDS Auto-Blocker started...")
     print(f"Monitoring for intrusions on SSID: {YOUR_ROUTER_SSID}")